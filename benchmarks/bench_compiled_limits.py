@@ -0,0 +1,59 @@
+import time
+from argparse import ArgumentParser
+from statistics import mean, stdev
+
+from threadpoolctl import ThreadpoolController
+
+parser = ArgumentParser(
+    description=(
+        "Measure the overhead of entering and exiting limits in a hot loop, with "
+        "ThreadpoolController.limit and with a plan from compile_limits."
+    )
+)
+parser.add_argument(
+    "--import",
+    dest="packages",
+    default=[],
+    nargs="+",
+    help="Python packages to import to load threadpool enabled libraries.",
+)
+parser.add_argument(
+    "--limits",
+    default=["1", "sequential_blas_under_openmp"],
+    nargs="+",
+    help="Limits to measure, either ints or 'sequential_blas_under_openmp'.",
+)
+parser.add_argument(
+    "--n-calls", type=int, default=10_000, help="Number of calls per measure"
+)
+parser.add_argument("--n-repeats", type=int, default=10, help="Number of measures")
+
+args = parser.parse_args()
+for package_name in args.packages:
+    __import__(package_name)
+
+controller = ThreadpoolController()
+if not controller:
+    print("No supported library found. Use --import to load some.")
+
+
+def time_per_call(make_context):
+    timings = []
+    for _ in range(args.n_repeats):
+        t = time.perf_counter_ns()
+        for _ in range(args.n_calls):
+            with make_context():
+                pass
+        timings.append((time.perf_counter_ns() - t) / args.n_calls / 1e3)
+    return f"{mean(timings):.2f} +/-{stdev(timings):.2f}"
+
+
+print(f"{'limits':>30} {'limit (us)':>16} {'compiled (us)':>16}")
+for limits in args.limits:
+    limits = int(limits) if limits.isdigit() else limits
+    plan = controller.compile_limits(limits=limits)
+    print(
+        f"{limits!s:>30} "
+        f"{time_per_call(lambda: controller.limit(limits=limits)):>16} "
+        f"{time_per_call(lambda: plan):>16}"
+    )
@@ -0,0 +1,83 @@
+import random
+import threading
+import time
+from argparse import ArgumentParser
+from statistics import mean, stdev
+
+from threadpoolctl import ThreadpoolController
+
+parser = ArgumentParser(
+    description=(
+        "Stress the limit stack with many threads entering and exiting nested "
+        "threadpool_limits contexts concurrently, and check that the original limits "
+        "are restored at the end."
+    )
+)
+parser.add_argument(
+    "--import",
+    dest="packages",
+    default=[],
+    nargs="+",
+    help="Python packages to import to load threadpool enabled libraries.",
+)
+parser.add_argument(
+    "--n-threads",
+    type=int,
+    nargs="+",
+    default=[1, 4, 16, 64],
+    help="Numbers of threads",
+)
+parser.add_argument(
+    "--n-iter", type=int, default=1000, help="Number of contexts entered per thread"
+)
+parser.add_argument("--n-repeats", type=int, default=5, help="Number of measures")
+parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+args = parser.parse_args()
+for package_name in args.packages:
+    __import__(package_name)
+
+controller = ThreadpoolController()
+if not controller:
+    print("No supported library found. Use --import to load some.")
+original_info = controller.info()
+
+
+def worker(rng, barrier):
+    barrier.wait()
+    for _ in range(args.n_iter):
+        with controller.limit(limits=rng.randint(1, 4)):
+            # Randomly nest a second context and exit them in a random order
+            if rng.random() < 0.5:
+                inner = controller.limit(limits=rng.randint(1, 4))
+                time.sleep(0)
+                inner.restore_original_limits()
+            time.sleep(0)
+
+
+def run(n_threads, seed):
+    barrier = threading.Barrier(n_threads + 1)
+    threads = [
+        threading.Thread(target=worker, args=(random.Random(seed + i), barrier))
+        for i in range(n_threads)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    t = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - t
+
+
+print(f"{'threads':>8} {'contexts':>10} {'time per context (us)':>24} {'restored':>9}")
+for n_threads in args.n_threads:
+    timings = []
+    for repeat in range(args.n_repeats):
+        duration = run(n_threads, seed=args.seed + repeat * n_threads)
+        timings.append(duration / (n_threads * args.n_iter))
+    restored = ThreadpoolController().info() == original_info
+    print(
+        f"{n_threads:>8} {n_threads * args.n_iter:>10} "
+        f"{mean(timings) * 1e6:>10.2f} +/-{stdev(timings) * 1e6:>9.2f} {restored!s:>9}"
+    )
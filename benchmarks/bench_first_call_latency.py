@@ -0,0 +1,58 @@
+import json
+import subprocess
+import sys
+from argparse import ArgumentParser
+from statistics import mean, stdev
+
+parser = ArgumentParser(
+    description=(
+        "Measure the latency of the first threadpool_info call in fresh Python "
+        "interpreters, with and without resolving the libc through find_library."
+    )
+)
+parser.add_argument(
+    "--import",
+    dest="packages",
+    default=[],
+    nargs="+",
+    help="Python packages to import to load threadpool enabled libraries.",
+)
+parser.add_argument(
+    "--n-runs", type=int, default=20, help="Number of fresh interpreters to run"
+)
+
+args = parser.parse_args()
+
+# Code run in each fresh interpreter. The packages are imported before starting the
+# timer since only the cost of the first threadpool_info call is measured.
+CODE = """
+import json
+import time
+for package_name in {packages!r}:
+    __import__(package_name)
+
+from threadpoolctl import ThreadpoolController, threadpool_info
+if {legacy!r}:
+    # Skip the fast paths to always resolve the libc with ctypes.util.find_library
+    ThreadpoolController._find_loaded_libc = classmethod(lambda cls: None)
+
+t = time.perf_counter()
+threadpool_info()
+print(json.dumps(time.perf_counter() - t))
+"""
+
+
+def first_call_latencies(legacy):
+    code = CODE.format(packages=args.packages, legacy=legacy)
+    return [
+        json.loads(subprocess.check_output([sys.executable, "-c", code]))
+        for _ in range(args.n_runs)
+    ]
+
+
+for name, legacy in (("find_library", True), ("loaded libc", False)):
+    timings = first_call_latencies(legacy)
+    print(
+        f"First threadpool_info call ({name}): "
+        f"{mean(timings) * 1e3:.3f} +/-{stdev(timings) * 1e3:.3f} ms"
+    )
@@ -0,0 +1,69 @@
+import json
+import os
+import time
+from argparse import ArgumentParser
+from statistics import mean, stdev
+
+from threadpoolctl import ThreadpoolController, threadpool_info, threadpool_limits
+
+parser = ArgumentParser(
+    description=(
+        "Measure the startup time of forked workers, i.e. the time to set limits in "
+        "each worker right after the fork, with the library controllers of the parent "
+        "reused or rediscovered from scratch."
+    )
+)
+parser.add_argument(
+    "--import",
+    dest="packages",
+    default=[],
+    nargs="+",
+    help="Python packages to import to load threadpool enabled libraries.",
+)
+parser.add_argument(
+    "--n-workers", type=int, default=20, help="Number of workers to fork"
+)
+
+args = parser.parse_args()
+for package_name in args.packages:
+    __import__(package_name)
+
+# Discover the libraries in the parent, as a prefork server would do before forking
+print(f"{len(threadpool_info())} libraries found in the parent process")
+
+
+def worker_startup(reuse):
+    if not reuse:
+        # Forget everything discovered in the parent process
+        ThreadpoolController._shared_instance = None
+        ThreadpoolController._lib_controllers_cache.clear()
+        ThreadpoolController._system_libraries.clear()
+
+    t = time.perf_counter()
+    threadpool_limits(limits=1)
+    return time.perf_counter() - t
+
+
+def fork_workers(reuse):
+    timings = []
+    for _ in range(args.n_workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(worker_startup(reuse), f)
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            timings.append(json.load(f))
+        os.waitpid(pid, 0)
+    return timings
+
+
+for name, reuse in (("rediscovered", False), ("reused", True)):
+    timings = fork_workers(reuse)
+    print(
+        f"Worker startup ({name}): "
+        f"{mean(timings) * 1e3:.3f} +/-{stdev(timings) * 1e3:.3f} ms"
+    )
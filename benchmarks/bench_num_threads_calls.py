@@ -0,0 +1,93 @@
+import time
+from argparse import ArgumentParser
+from statistics import mean, stdev
+
+from threadpoolctl import ThreadpoolController
+
+parser = ArgumentParser(
+    description=(
+        "Measure the cost per call of get_num_threads and set_num_threads for each "
+        "library controller, compared to resolving the symbol at each call."
+    )
+)
+parser.add_argument(
+    "--import",
+    dest="packages",
+    default=[],
+    nargs="+",
+    help="Python packages to import to load threadpool enabled libraries.",
+)
+parser.add_argument(
+    "--n-calls", type=int, default=100_000, help="Number of calls per measure"
+)
+parser.add_argument("--n-repeats", type=int, default=10, help="Number of measures")
+
+args = parser.parse_args()
+for package_name in args.packages:
+    __import__(package_name)
+
+# Symbols called by the get_num_threads and set_num_threads methods of the builtin
+# controllers.
+SYMBOLS = {
+    "openblas": ("openblas_get_num_threads", "openblas_set_num_threads"),
+    "blis": ("bli_thread_get_num_threads", "bli_thread_set_num_threads"),
+    "flexiblas": ("flexiblas_get_num_threads", "flexiblas_set_num_threads"),
+    "mkl": ("MKL_Get_Max_Threads", "MKL_Set_Num_Threads"),
+    "openmp": ("omp_get_max_threads", "omp_set_num_threads"),
+}
+
+
+def resolve_each_call(lib_controller, name):
+    """Resolve the symbol at each call as done before the call table"""
+
+    def func(*args):
+        symbol = getattr(
+            lib_controller.dynlib,
+            f"{lib_controller._symbol_prefix}{name}{lib_controller._symbol_suffix}",
+            lambda *args: None,
+        )
+        return symbol(*args)
+
+    return func
+
+
+def time_per_call(func, *call_args):
+    timings = []
+    for _ in range(args.n_repeats):
+        t = time.perf_counter_ns()
+        for _ in range(args.n_calls):
+            func(*call_args)
+        timings.append((time.perf_counter_ns() - t) / args.n_calls)
+    return f"{mean(timings):.0f} +/-{stdev(timings):.0f}"
+
+
+controller = ThreadpoolController()
+if not controller:
+    print("No supported library found. Use --import to load some.")
+
+print(f"{'library':>50} {'call':>16} {'resolve (ns)':>14} {'table (ns)':>14}")
+for lib_controller in controller.lib_controllers:
+    if lib_controller.internal_api not in SYMBOLS:
+        continue
+    get_symbol, set_symbol = SYMBOLS[lib_controller.internal_api]
+    num_threads = lib_controller.get_num_threads()
+
+    for call, before, after, call_args in (
+        (
+            "get_num_threads",
+            resolve_each_call(lib_controller, get_symbol),
+            lib_controller.get_num_threads,
+            (),
+        ),
+        (
+            "set_num_threads",
+            resolve_each_call(lib_controller, set_symbol),
+            lib_controller.set_num_threads,
+            (num_threads,),
+        ),
+    ):
+        print(
+            f"{lib_controller.filepath[-50:]:>50} {call:>16} "
+            f"{time_per_call(before, *call_args):>14} "
+            f"{time_per_call(after, *call_args):>14}"
+        )
@@ -0,0 +1,85 @@
+import time
+from argparse import ArgumentParser
+from statistics import mean, stdev
+
+from threadpoolctl import _ALL_CONTROLLERS, _PrefixIndex
+
+parser = ArgumentParser(
+    description=(
+        "Measure the cost of classifying loaded shared libraries by filename prefix "
+        "against the number of registered controllers and loaded libraries."
+    )
+)
+parser.add_argument(
+    "--n-controllers",
+    type=int,
+    nargs="+",
+    default=[0, 10, 100],
+    help="Numbers of third party controllers registered on top of the builtin ones.",
+)
+parser.add_argument(
+    "--n-dsos",
+    type=int,
+    nargs="+",
+    default=[50, 400, 2000],
+    help="Numbers of loaded shared libraries to classify.",
+)
+parser.add_argument("--n-calls", type=int, default=20, help="Number of iterations")
+
+args = parser.parse_args()
+
+
+def make_controllers(n_controllers):
+    """Builtin controllers + n_controllers fake third party controllers"""
+    third_party = [
+        type(f"Controller{i}", (), {"filename_prefixes": (f"libthirdparty{i}_",)})
+        for i in range(n_controllers)
+    ]
+    return list(_ALL_CONTROLLERS) + third_party
+
+
+def make_filenames(n_dsos):
+    """Mostly unrelated libraries with a few ones matching a prefix"""
+    matching = ["libopenblas64_.so.0", "libgomp.so.1", "libmkl_rt.so.2"]
+    unrelated = [f"libsomething{i}.so.{i % 7}" for i in range(n_dsos - len(matching))]
+    return unrelated + matching
+
+
+def linear_match(controllers, filename):
+    """Reference implementation: loop over all the prefixes of all the controllers"""
+    matches = []
+    for controller_class in controllers:
+        for prefix in controller_class.filename_prefixes:
+            if filename.startswith(prefix):
+                matches.append((controller_class, prefix))
+                break
+    return matches
+
+
+def timeit(func, filenames):
+    timings = []
+    for _ in range(args.n_calls):
+        t = time.perf_counter()
+        for filename in filenames:
+            func(filename)
+        timings.append(time.perf_counter() - t)
+    return timings
+
+
+print(f"{'controllers':>12} {'dsos':>6} {'linear (ms)':>18} {'index (ms)':>18}")
+for n_controllers in args.n_controllers:
+    controllers = make_controllers(n_controllers)
+    index = _PrefixIndex(controllers)
+    for n_dsos in args.n_dsos:
+        filenames = make_filenames(n_dsos)
+        assert all(
+            index.match(filename) == linear_match(controllers, filename)
+            for filename in filenames
+        )
+
+        results = []
+        for func in (lambda f: linear_match(controllers, f), index.match):
+            timings = timeit(func, filenames)
+            results.append(f"{mean(timings) * 1e3:.3f} +/-{stdev(timings) * 1e3:.3f}")
+
+        print(f"{len(controllers):>12} {n_dsos:>6} {results[0]:>18} {results[1]:>18}")
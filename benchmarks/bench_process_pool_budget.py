@@ -0,0 +1,64 @@
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from statistics import mean, stdev
+
+from threadpoolctl import process_pool_executor, threadpool_info
+
+parser = ArgumentParser(
+    description=(
+        "Compare the throughput of a GEMM-heavy workload run in a process pool, with "
+        "and without splitting the CPUs between the thread pools of the workers."
+    )
+)
+parser.add_argument(
+    "--n-workers", type=int, nargs="+", default=[2, 4], help="Numbers of workers"
+)
+parser.add_argument("--size", type=int, default=1000, help="Size of the matrices")
+parser.add_argument(
+    "--n-tasks", type=int, default=32, help="Number of matrix products per measure"
+)
+parser.add_argument("--n-repeats", type=int, default=3, help="Number of measures")
+
+
+def gemm(size):
+    import numpy as np
+
+    a = np.random.randn(size, size)
+    return float((a @ a).sum())
+
+
+def get_num_threads():
+    return [lib_info["num_threads"] for lib_info in threadpool_info()]
+
+
+def throughput(executor, n_workers, args):
+    # Warm up the workers, then measure the number of products per second
+    list(executor.map(gemm, [args.size] * n_workers))
+    timings = []
+    for _ in range(args.n_repeats):
+        t = time.perf_counter()
+        list(executor.map(gemm, [args.size] * args.n_tasks))
+        timings.append(args.n_tasks / (time.perf_counter() - t))
+    return f"{mean(timings):.1f} +/-{stdev(timings):.1f}"
+
+
+if __name__ == "__main__":
+    # The guard is required since the workers can import this module to retrieve the
+    # functions to run, depending on the start method of the processes.
+    args = parser.parse_args()
+
+    print(
+        f"{'workers':>8} {'threads':>10} {'default (GEMM/s)':>18} "
+        f"{'split (GEMM/s)':>18}"
+    )
+    for n_workers in args.n_workers:
+        with ProcessPoolExecutor(n_workers) as executor:
+            default = throughput(executor, n_workers, args)
+        with process_pool_executor(n_workers) as executor:
+            split = throughput(executor, n_workers, args)
+            num_threads = executor.submit(get_num_threads).result()
+        print(
+            f"{n_workers:>8} {max(num_threads, default=0):>10} {default:>18} "
+            f"{split:>18}"
+        )
@@ -0,0 +1,184 @@
+"""Benchmark suite of the main entry points of threadpoolctl.
+
+Each benchmark runs a statement `--n-calls` times in a loop, `--n-repeats` times, and
+reports percentiles of the time per call over the repeats. The results can be saved
+as a JSON baseline and compared to a baseline, e.g. from another version:
+
+    python benchmarks/bench_suite.py --import numpy --output baseline.json
+    git checkout other-branch
+    python benchmarks/bench_suite.py --import numpy --compare baseline.json
+"""
+
+import json
+import platform
+import sys
+import time
+from argparse import ArgumentParser
+from statistics import mean
+
+import threadpoolctl
+from threadpoolctl import ThreadpoolController
+
+parser = ArgumentParser(
+    description="Benchmark the main entry points of threadpoolctl.",
+)
+parser.add_argument(
+    "--import",
+    dest="packages",
+    default=[],
+    nargs="+",
+    help="Python packages to import to load threadpool enabled libraries.",
+)
+parser.add_argument(
+    "--n-calls", type=int, default=100, help="Number of calls per repeat"
+)
+parser.add_argument(
+    "--n-repeats", type=int, default=50, help="Number of repeats per benchmark"
+)
+parser.add_argument(
+    "--filter",
+    default=None,
+    help="Only run the benchmarks whose name contains this string.",
+)
+parser.add_argument("--output", default=None, help="Path to save the JSON results.")
+parser.add_argument(
+    "--compare", default=None, help="Path to JSON results to compare against."
+)
+parser.add_argument(
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="Relative change of the median reported as significant when comparing.",
+)
+
+PERCENTILES = (0, 50, 90, 99)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of a sorted list"""
+    index = round(q / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def run_benchmark(func, n_calls, n_repeats):
+    """Time per call in ns of each repeat, after one warmup repeat"""
+    timings = []
+    for _ in range(n_repeats + 1):
+        t = time.perf_counter_ns()
+        for _ in range(n_calls):
+            func()
+        timings.append((time.perf_counter_ns() - t) / n_calls)
+    return sorted(timings[1:])
+
+
+def get_benchmarks():
+    """Dict {name: (func, n_calls_factor)} of the benchmarks to run"""
+    controller = ThreadpoolController()
+
+    def limit():
+        with controller.limit(limits=1):
+            pass
+
+    @controller.wrap(limits=1)
+    def wrapped():
+        pass
+
+    benchmarks = {
+        # Construction rescans all the loaded libraries: fewer calls per repeat
+        "ThreadpoolController()": (ThreadpoolController, 0.1),
+        "threadpool_info()": (threadpoolctl.threadpool_info, 1),
+        "ThreadpoolController.info()": (controller.info, 1),
+        "ThreadpoolController.limit() enter/exit": (limit, 1),
+        "ThreadpoolController.wrap() call": (wrapped, 1),
+        "ThreadpoolController.select()": (
+            lambda: controller.select(user_api="blas"),
+            1,
+        ),
+    }
+    for lib_controller in controller.lib_controllers:
+        num_threads = lib_controller.get_num_threads()
+        name = f"{lib_controller.internal_api}:{lib_controller.prefix}"
+        benchmarks[f"set_num_threads [{name}]"] = (
+            lambda lc=lib_controller, n=num_threads: lc.set_num_threads(n),
+            10,
+        )
+    return benchmarks
+
+
+def format_ns(ns):
+    for unit, factor in (("s", 1e9), ("ms", 1e6), ("us", 1e3)):
+        if ns >= factor:
+            return f"{ns / factor:.2f} {unit}"
+    return f"{ns:.0f} ns"
+
+
+def main(args):
+    for package_name in args.packages:
+        __import__(package_name)
+
+    results = {
+        "metadata": {
+            "threadpoolctl_version": threadpoolctl.__version__,
+            "python_version": sys.version,
+            "platform": platform.platform(),
+            "packages": args.packages,
+            "libraries": threadpoolctl.threadpool_info(),
+        },
+        "benchmarks": {},
+    }
+
+    header = " ".join(f"{f'p{q}':>10}" for q in PERCENTILES)
+    print(f"{'benchmark':<60} {header} {'mean':>10}")
+    for name, (func, factor) in get_benchmarks().items():
+        if args.filter is not None and args.filter not in name:
+            continue
+        n_calls = max(1, int(args.n_calls * factor))
+        timings = run_benchmark(func, n_calls, args.n_repeats)
+        stats = {f"p{q}": percentile(timings, q) for q in PERCENTILES}
+        stats["mean"] = mean(timings)
+        results["benchmarks"][name] = {
+            **stats,
+            "n_calls": n_calls,
+            "n_repeats": args.n_repeats,
+            "timings_ns": timings,
+        }
+        row = " ".join(f"{format_ns(stats[f'p{q}']):>10}" for q in PERCENTILES)
+        print(f"{name[:60]:<60} {row} {format_ns(stats['mean']):>10}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    if args.compare is not None:
+        compare(results, args.compare, args.threshold)
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print(
+        f"\nComparison of the medians to {baseline_path} (threadpoolctl "
+        f"{baseline['metadata']['threadpoolctl_version']}):"
+    )
+    for name, stats in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            print(f"{name[:60]:<60} {'(not in baseline)':>24}")
+            continue
+        before = baseline["benchmarks"][name]["p50"]
+        ratio = stats["p50"] / before
+        if ratio > 1 + threshold:
+            verdict = "slower"
+        elif ratio < 1 / (1 + threshold):
+            verdict = "faster"
+        else:
+            verdict = "not significant"
+        print(
+            f"{name[:60]:<60} {format_ns(before):>10} -> {format_ns(stats['p50']):>10}"
+            f" {ratio:>6.2f}x {verdict}"
+        )
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
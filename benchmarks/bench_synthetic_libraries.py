@@ -0,0 +1,223 @@
+"""Measure how threadpoolctl scales with the number of loaded shared libraries.
+
+A new process is started for each number of libraries, which loads that many synthetic
+shared libraries compiled locally:
+
+- 1/4 match the prefix of a third party controller and expose its symbols,
+- 1/4 are decoys, matching the prefix of the third party controller or of a builtin
+  controller but missing their `check_symbols`,
+- 1/2 are unrelated.
+
+The libraries are compiled once and then copied, such that each copy is a distinct
+file loaded separately by the dynamic loader. Each measure is made with and without
+the third party controller registered. Without it, the matching libraries and the
+decoys of its prefix are just more unrelated libraries.
+
+Requires a C compiler (see --cc) and a platform where ThreadpoolController finds the
+libraries with dl_iterate_phdr, e.g. Linux.
+"""
+
+import ctypes
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS, ArgumentParser
+from statistics import mean, stdev
+
+from threadpoolctl import LibController, ThreadpoolController, register
+from threadpoolctl import threadpool_limits
+
+parser = ArgumentParser(
+    description=(
+        "Measure the cost of ThreadpoolController construction, info and "
+        "threadpool_limits against the number of loaded shared libraries."
+    )
+)
+parser.add_argument(
+    "--n-libraries",
+    type=int,
+    nargs="+",
+    default=[0, 100, 400, 1000],
+    help="Numbers of synthetic shared libraries to load.",
+)
+parser.add_argument(
+    "--import",
+    dest="packages",
+    default=[],
+    nargs="+",
+    help="Python packages to import to load threadpool enabled libraries.",
+)
+parser.add_argument(
+    "--n-calls", type=int, default=100, help="Number of calls per measure"
+)
+parser.add_argument("--n-repeats", type=int, default=5, help="Number of measures")
+parser.add_argument("--cc", default="cc", help="C compiler used to build libraries")
+parser.add_argument(
+    "--build-dir",
+    default=None,
+    help="Directory to build the libraries in. Defaults to a temporary directory.",
+)
+# Used internally to run the measures of one configuration in a new process
+parser.add_argument("--worker", nargs=2, metavar=("N", "REGISTERED"), help=SUPPRESS)
+
+SOURCES = {
+    "matching": (
+        "static int num_threads = 4;\n"
+        "int synthpool_get_num_threads(void) { return num_threads; }\n"
+        "void synthpool_set_num_threads(int n) { num_threads = n; }\n"
+    ),
+    "decoy": "int synthpool_decoy_function(void) { return 0; }\n",
+    "unrelated": "int unrelated_function(void) { return 0; }\n",
+}
+
+
+class SyntheticController(LibController):
+    """Third party controller of the matching synthetic libraries"""
+
+    user_api = "synthetic"
+    internal_api = "synthetic"
+    filename_prefixes = ("libsynthpool",)
+    check_symbols = ("synthpool_get_num_threads", "synthpool_set_num_threads")
+
+    def get_num_threads(self):
+        return self.dynlib.synthpool_get_num_threads()
+
+    def set_num_threads(self, num_threads):
+        self.dynlib.synthpool_set_num_threads(num_threads)
+
+    def get_version(self):
+        return None
+
+
+def library_names(n_libraries):
+    """Filenames and kinds of the synthetic libraries"""
+    names = []
+    for i in range(n_libraries):
+        if i % 4 == 0:
+            names.append((f"libsynthpool_{i}.so", "matching"))
+        elif i % 8 == 1:
+            # Matches the prefix of the third party controller
+            names.append((f"libsynthpool_decoy_{i}.so", "decoy"))
+        elif i % 8 == 5:
+            # Matches the prefixes of builtin controllers
+            prefix = ("libopenblas", "libgomp", "libmkl_rt", "libflexiblas")[i // 8 % 4]
+            names.append((f"{prefix}_decoy_{i}.so", "decoy"))
+        else:
+            names.append((f"libunrelated_{i}.so", "unrelated"))
+    return names
+
+
+def build_templates(build_dir, cc):
+    """Compile one library of each kind"""
+    templates = {}
+    for kind, source in SOURCES.items():
+        source_path = os.path.join(build_dir, f"{kind}.c")
+        with open(source_path, "w") as f:
+            f.write(source)
+        templates[kind] = os.path.join(build_dir, f"template_{kind}.so")
+        subprocess.run(
+            [cc, "-shared", "-fpic", "-o", templates[kind], source_path], check=True
+        )
+    return templates
+
+
+def copy_templates(build_dir, templates, n_libraries):
+    """Copy the compiled libraries under the filenames of the synthetic libraries"""
+    for filename, kind in library_names(n_libraries):
+        path = os.path.join(build_dir, filename)
+        if not os.path.exists(path):
+            shutil.copyfile(templates[kind], path)
+
+
+def timeit(func, args):
+    timings = []
+    for _ in range(args.n_repeats):
+        t = time.perf_counter()
+        for _ in range(args.n_calls):
+            func()
+        timings.append((time.perf_counter() - t) / args.n_calls)
+    return mean(timings), stdev(timings)
+
+
+def limit():
+    with threadpool_limits(limits=1):
+        pass
+
+
+def worker(args):
+    """Load the libraries and run the measures, in a new process"""
+    n_libraries, registered = int(args.worker[0]), args.worker[1] == "registered"
+    for package_name in args.packages:
+        __import__(package_name)
+    if registered:
+        register(SyntheticController)
+
+    for filename, _ in library_names(n_libraries):
+        ctypes.CDLL(os.path.join(args.build_dir, filename))
+
+    t = time.perf_counter()
+    controller = ThreadpoolController()
+    first_construction = time.perf_counter() - t
+
+    results = {
+        "n_controllers": len(controller.lib_controllers),
+        "first_construction": first_construction,
+        "construction": timeit(ThreadpoolController, args),
+        "info": timeit(controller.info, args),
+        "threadpool_limits": timeit(limit, args),
+    }
+    json.dump(results, sys.stdout)
+
+
+def run_worker(n_libraries, registered, args):
+    cmd = [
+        sys.executable,
+        __file__,
+        "--worker",
+        str(n_libraries),
+        registered,
+        "--build-dir",
+        args.build_dir,
+        f"--n-calls={args.n_calls}",
+        f"--n-repeats={args.n_repeats}",
+    ]
+    if args.packages:
+        cmd += ["--import", *args.packages]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main(args):
+    print(
+        f"{'libraries':>10} {'controller':>14} {'found':>6} {'first (ms)':>11} "
+        f"{'construction (ms)':>18} {'info (ms)':>16} {'limits (ms)':>16}"
+    )
+    templates = build_templates(args.build_dir, args.cc)
+    for n_libraries in args.n_libraries:
+        copy_templates(args.build_dir, templates, n_libraries)
+        for registered in ("unregistered", "registered"):
+            results = run_worker(n_libraries, registered, args)
+            row = " ".join(
+                f"{results[name][0] * 1e3:>7.3f} +/-{results[name][1] * 1e3:.3f}"
+                for name in ("construction", "info", "threadpool_limits")
+            )
+            print(
+                f"{n_libraries:>10} {registered:>14} {results['n_controllers']:>6} "
+                f"{results['first_construction'] * 1e3:>11.3f} {row}"
+            )
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.worker is not None:
+        worker(args)
+    elif args.build_dir is not None:
+        main(args)
+    else:
+        with tempfile.TemporaryDirectory() as build_dir:
+            args.build_dir = build_dir
+            main(args)
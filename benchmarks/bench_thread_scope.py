@@ -0,0 +1,73 @@
+import threading
+import time
+from argparse import ArgumentParser
+from statistics import mean, stdev
+
+from threadpoolctl import ThreadpoolController
+
+# Requires the Cython helpers of the test suite to be compiled, see
+# continuous_integration/build_test_ext.sh
+from tests._openmp_test_helper.openmp_helpers_inner import check_openmp_num_threads
+
+parser = ArgumentParser(
+    description=(
+        "Run several Python threads in parallel, each with its own OpenMP thread "
+        "budget set with scope='thread', and check the number of threads effectively "
+        "used by the OpenMP parallel regions of each thread."
+    )
+)
+parser.add_argument(
+    "--budgets",
+    type=int,
+    nargs="+",
+    default=[1, 2, 4],
+    help="OpenMP thread budget of each Python thread.",
+)
+parser.add_argument(
+    "--n", type=int, default=10_000, help="Size of each OpenMP parallel loop"
+)
+parser.add_argument(
+    "--n-calls", type=int, default=200, help="Number of parallel loops per thread"
+)
+parser.add_argument("--n-repeats", type=int, default=5, help="Number of measures")
+
+args = parser.parse_args()
+
+controller = ThreadpoolController()
+if not controller.select(internal_api="openmp"):
+    print("No OpenMP library found.")
+
+
+def worker(budget, barrier, results):
+    with controller.limit(limits=budget, user_api="openmp", scope="thread"):
+        barrier.wait()
+        t = time.perf_counter()
+        used = {check_openmp_num_threads(args.n) for _ in range(args.n_calls)}
+        results[budget] = (time.perf_counter() - t, used)
+
+
+print(f"{'budget':>7} {'threads used':>13} {'time per loop (us)':>22}")
+timings = {budget: [] for budget in args.budgets}
+used_num_threads = {budget: set() for budget in args.budgets}
+for _ in range(args.n_repeats):
+    results = {}
+    barrier = threading.Barrier(len(args.budgets))
+    threads = [
+        threading.Thread(target=worker, args=(budget, barrier, results))
+        for budget in args.budgets
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for budget, (duration, used) in results.items():
+        timings[budget].append(duration / args.n_calls)
+        used_num_threads[budget] |= used
+
+for budget in args.budgets:
+    used = ",".join(str(n) for n in sorted(used_num_threads[budget]))
+    print(
+        f"{budget:>7} {used:>13} "
+        f"{mean(timings[budget]) * 1e6:>10.1f} +/-{stdev(timings[budget]) * 1e6:>8.1f}"
+    )
@@ -0,0 +1,59 @@
+import time
+from argparse import ArgumentParser
+from statistics import mean, stdev
+
+from threadpoolctl import ThreadpoolController
+
+parser = ArgumentParser(
+    description=(
+        "Measure the per-call overhead of a function decorated with wrap_by_size, "
+        "for sizes below, within and above the thresholds."
+    )
+)
+parser.add_argument(
+    "--import",
+    dest="packages",
+    default=[],
+    nargs="+",
+    help="Python packages to import to load threadpool enabled libraries.",
+)
+parser.add_argument(
+    "--n-calls", type=int, default=10_000, help="Number of calls per measure"
+)
+parser.add_argument("--n-repeats", type=int, default=10, help="Number of measures")
+
+args = parser.parse_args()
+for package_name in args.packages:
+    __import__(package_name)
+
+controller = ThreadpoolController()
+if not controller:
+    print("No supported library found. Use --import to load some.")
+
+THRESHOLDS = {100: 1, 10_000: 2, 1_000_000: None}
+
+
+def func(size):
+    pass
+
+
+decorated = controller.wrap_by_size(size=lambda size: size, thresholds=THRESHOLDS)(func)
+
+
+def time_per_call(func, size):
+    timings = []
+    for _ in range(args.n_repeats):
+        t = time.perf_counter_ns()
+        for _ in range(args.n_calls):
+            func(size)
+        timings.append((time.perf_counter_ns() - t) / args.n_calls / 1e3)
+    return f"{mean(timings):.2f} +/-{stdev(timings):.2f}"
+
+
+print(f"thresholds: {THRESHOLDS}")
+print(f"{'size':>10} {'undecorated (us)':>18} {'wrap_by_size (us)':>18}")
+for size in (10, 1000, 100_000, 10_000_000):
+    print(
+        f"{size:>10} {time_per_call(func, size):>18} "
+        f"{time_per_call(decorated, size):>18}"
+    )
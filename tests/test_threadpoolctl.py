@@ -1,13 +1,22 @@
+import asyncio
+import ctypes
+import itertools
 import json
 import os
 import pytest
 import re
 import subprocess
 import sys
+import threading
+import time
 
-from threadpoolctl import threadpool_limits, threadpool_info
-from threadpoolctl import ThreadpoolController
+import threadpoolctl
+from threadpoolctl import threadpool_limits, threadpool_info, threadpool_limits_stats
+from threadpoolctl import ThreadpoolController, LibController
 from threadpoolctl import _ALL_PREFIXES, _ALL_USER_APIS
+from threadpoolctl import _PrefixIndex, _get_prefix_index
+from threadpoolctl import process_pool_executor, available_cpus, set_child_limits
+from threadpoolctl import tune, _limit_stack
 
 from .utils import cython_extensions_compiled
 from .utils import check_nested_prange_blas
@@ -77,6 +86,87 @@ def test_threadpool_controller_info():
             assert "threading_layer" in lib_controller_dict
 
 
+def test_info_fields():
+    # Check that info only computes the requested entries.
+    controller = ThreadpoolController()
+    full_info = controller.info()
+
+    fields = ["num_threads", "filepath", "architecture"]
+    expected = [
+        {key: lib_info[key] for key in fields if key in lib_info}
+        for lib_info in full_info
+    ]
+    assert controller.info(fields=fields) == expected
+    assert threadpool_info(fields=fields) == expected
+
+    for lib_controller in controller.lib_controllers:
+        # Instantiate a new library controller since they are cached and reused
+        new_lib_controller = type(lib_controller)(
+            filepath=lib_controller.filepath, prefix=lib_controller.prefix
+        )
+        new_lib_controller.info(fields=["num_threads", "filepath"])
+        assert "version" not in vars(new_lib_controller)
+
+        assert new_lib_controller.info() == lib_controller.info()
+        assert "version" in vars(new_lib_controller)
+
+
+def test_info_without_fields_parameter():
+    # Check that the controllers of third party libraries that override info
+    # without the fields parameter are still supported.
+    controller = ThreadpoolController()
+    if not controller:
+        pytest.skip("Requires at least one supported library")
+
+    old_style_lib_controllers = []
+    for lib_controller in controller.lib_controllers:
+
+        class OldStyleController(type(lib_controller)):
+            def info(self):
+                return super().info()
+
+        old_style_lib_controllers.append(
+            OldStyleController(
+                filepath=lib_controller.filepath, prefix=lib_controller.prefix
+            )
+        )
+    old_style_controller = ThreadpoolController._from_controllers(
+        old_style_lib_controllers
+    )
+
+    assert old_style_controller.info() == controller.info()
+    fields = ["num_threads", "filepath"]
+    assert old_style_controller.info(fields=fields) == controller.info(fields=fields)
+    old_style_controller.oversubscription_report()
+
+
+def test_foreign_functions_resolved_once():
+    # Check that the get/set functions of the builtin controllers are resolved and
+    # typed only once.
+    controller = ThreadpoolController().select(
+        internal_api=["openblas", "blis", "flexiblas", "mkl", "openmp"]
+    )
+    if not controller:
+        pytest.skip("Requires at least one supported library")
+
+    for lib_controller in controller.lib_controllers:
+        num_threads = lib_controller.get_num_threads()
+        lib_controller.set_num_threads(num_threads)
+
+        get_func = vars(lib_controller)["_get_num_threads_func"]
+        set_func = vars(lib_controller)["_set_num_threads_func"]
+        # BLIS uses its 64 bits dim_t type for the number of threads
+        int_type = (
+            ctypes.c_int64 if lib_controller.internal_api == "blis" else ctypes.c_int
+        )
+        assert get_func.restype is int_type
+        assert set_func.restype is None
+        assert set_func.argtypes == (int_type,)
+
+        assert lib_controller.get_num_threads() == num_threads
+        assert lib_controller._get_num_threads_func is get_func
+
+
 def test_controller_info_actualized():
     # Check that the num_threads attribute reflects the actual state of the threadpools
     controller = ThreadpoolController()
@@ -91,6 +181,91 @@ def test_controller_info_actualized():
     assert controller.info() == original_info
 
 
+def test_shared_controller_refresh(monkeypatch):
+    # Check that the shared controller is only rescanned when shared libraries were
+    # loaded or unloaded since the last scan.
+    controller = ThreadpoolController()
+    generation = controller._get_loaded_libraries_generation()
+    if generation is None:
+        pytest.skip("Requires the dl_iterate_phdr generation counters")
+
+    assert ThreadpoolController._get_shared_instance().info() == controller.info()
+    shared_instance = ThreadpoolController._shared_instance
+
+    n_calls = {"load": 0, "make": 0}
+    load_libraries = ThreadpoolController._load_libraries
+    make_controller_from_path = ThreadpoolController._make_controller_from_path
+
+    def counting_load_libraries(self):
+        n_calls["load"] += 1
+        load_libraries(self)
+
+    def counting_make_controller_from_path(self, filepath):
+        n_calls["make"] += 1
+        make_controller_from_path(self, filepath)
+
+    monkeypatch.setattr(
+        ThreadpoolController, "_load_libraries", counting_load_libraries
+    )
+    monkeypatch.setattr(
+        ThreadpoolController,
+        "_make_controller_from_path",
+        counting_make_controller_from_path,
+    )
+
+    # Nothing was loaded or unloaded: no rescan.
+    assert threadpool_info() == controller.info()
+    assert n_calls == {"load": 0, "make": 0}
+
+    # Only loads happened: already seen libraries are not inspected again.
+    adds, subs = shared_instance._generation
+    shared_instance._generation = (adds - 1, subs)
+    assert threadpool_info() == controller.info()
+    assert n_calls == {"load": 1, "make": 0}
+
+    # An unload happened: full rescan.
+    shared_instance._generation = (adds, subs - 1)
+    assert threadpool_info() == controller.info()
+    assert n_calls["load"] == 2
+    assert n_calls["make"] > 0
+
+
+def test_shared_controller_snapshot():
+    # Check that threadpool_limits works on a snapshot of the lib controllers of the
+    # shared controller, not affected by later rescans.
+    with threadpool_limits(limits=1) as limiter:
+        lib_controllers = limiter._controller.lib_controllers
+        ThreadpoolController._shared_instance._generation = None
+        threadpool_info()
+        assert limiter._controller.lib_controllers is lib_controllers
+        assert (
+            lib_controllers is not ThreadpoolController._shared_instance.lib_controllers
+        )
+
+
+def test_lib_controllers_reused():
+    # Check that the library controllers are reused by all the ThreadpoolController
+    # instances, which are all tracked as holding them, without changing their
+    # parent.
+    controller = ThreadpoolController()
+    if not controller:
+        pytest.skip("Requires at least one supported library")
+    parents = [lib_controller.parent for lib_controller in controller.lib_controllers]
+
+    other_controller = ThreadpoolController()
+    for lib_controller, other_lib_controller, parent in zip(
+        controller.lib_controllers, other_controller.lib_controllers, parents
+    ):
+        assert lib_controller is other_lib_controller
+        assert lib_controller.parent is parent
+        assert controller in lib_controller._parents
+        assert other_controller in lib_controller._parents
+
+    cached_lib_controllers = ThreadpoolController._lib_controllers_cache.values()
+    for lib_controller in controller.lib_controllers:
+        assert any(lib_controller is cached for cached in cached_lib_controllers)
+
+
 @pytest.mark.parametrize(
     "kwargs",
     [
@@ -209,6 +384,65 @@ def test_threadpool_limits_manual_restore():
     assert ThreadpoolController().info() == original_info
 
 
+def test_threadpool_limits_snapshot_num_threads_only(monkeypatch):
+    # Check that only the number of threads of each library is recorded when setting
+    # the limits and that the full info dicts are built on demand.
+    controller = ThreadpoolController()
+    original_info = controller.info()
+
+    def info(self, fields=None):
+        raise AssertionError("info should not be called")
+
+    with monkeypatch.context() as m:
+        m.setattr(LibController, "info", info)
+        limiter = controller.limit(limits=1)
+        limiter.get_original_num_threads()
+        limiter.restore_original_limits()
+
+    assert limiter._original_num_threads == [
+        lib_info["num_threads"] for lib_info in original_info
+    ]
+    assert limiter._original_info == original_info
+    assert controller.info() == original_info
+
+
+def test_threadpool_limits_skip_unchanged_num_threads(monkeypatch):
+    # Check that set_num_threads is only called for the libraries whose number of
+    # threads actually changes, both when setting and when restoring the limits.
+    controller = ThreadpoolController()
+    if not controller:
+        pytest.skip("Requires at least one supported library")
+
+    calls = []
+    for lib_controller in controller.lib_controllers:
+        monkeypatch.setattr(
+            type(lib_controller), "set_num_threads", lambda lc, n: calls.append(lc)
+        )
+
+    threadpool_limits_stats(reset=True)
+    original_num_threads = [lc.get_num_threads() for lc in controller.lib_controllers]
+    limits = {lc.prefix: lc.get_num_threads() for lc in controller.lib_controllers}
+    with controller.limit(limits=limits):
+        pass
+
+    assert calls == []
+    stats = threadpool_limits_stats(reset=True)
+    assert stats["set_num_threads_calls"] == 0
+    assert stats["skipped_set_num_threads_calls"] == 2 * len(controller.lib_controllers)
+    assert threadpool_limits_stats()["skipped_set_num_threads_calls"] == 0
+
+    # Libraries already single-threaded are skipped
+    expected_calls = [
+        lc
+        for lc, num_threads in zip(controller.lib_controllers, original_num_threads)
+        if num_threads != 1
+    ]
+    with controller.limit(limits=1):
+        assert calls == expected_calls
+    stats = threadpool_limits_stats(reset=True)
+    assert stats["set_num_threads_calls"] == len(expected_calls)
+
+
 def test_threadpool_controller_limit():
     # Check that using the limit method of ThreadpoolController only impact its
     # library controllers.
@@ -286,6 +520,259 @@ def test_nested_limits():
     assert ThreadpoolController().info() == original_info
 
 
+def test_compile_limits():
+    # Check that a compiled plan sets the same limits as the limit method and that it
+    # can be entered several times, including nested.
+    controller = ThreadpoolController()
+    original_info = controller.info()
+
+    plan = controller.compile_limits(limits={"blas": 1, "openmp": None})
+    assert [lib_controller for lib_controller, _ in plan.limits] == (
+        controller.lib_controllers
+    )
+    for lib_controller, num_threads in plan.limits:
+        assert num_threads == (1 if lib_controller.user_api == "blas" else None)
+
+    with controller.limit(limits={"blas": 1, "openmp": None}):
+        expected_info = controller.info()
+
+    for _ in range(3):
+        with plan as entered_plan:
+            assert entered_plan is plan
+            assert controller.info() == expected_info
+            with plan:
+                assert controller.info() == expected_info
+            assert controller.info() == expected_info
+        assert controller.info() == original_info
+        assert not _limit_stack._libraries
+
+    # The parameters are validated when compiling the plan
+    with pytest.raises(ValueError, match="user_api must be either in"):
+        controller.compile_limits(limits=1, user_api="wrong")
+
+
+def test_limits_without_with():
+    # Check that the limits set without a with statement, e.g. by calling
+    # threadpool_limits as a function, are kept as the new values to restore, from
+    # any thread, and that they don't pile up in the limit stack.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    controller = ThreadpoolController().select(user_api="my_threaded_lib")
+    lib_controller = controller.lib_controllers[0]
+    original_num_threads = lib_controller.num_threads
+
+    try:
+        thread = threading.Thread(target=controller.limit, kwargs={"limits": 1})
+        thread.start()
+        thread.join()
+        assert lib_controller.num_threads == 1
+
+        controller.limit(limits=8)
+        assert lib_controller.num_threads == 8
+        with controller.limit(limits=16):
+            assert lib_controller.num_threads == 16
+        assert lib_controller.num_threads == 8
+
+        # Within a with block, the limits are kept until the block exits
+        with controller.limit(limits=4):
+            controller.limit(limits=2)
+            assert lib_controller.num_threads == 2
+        assert lib_controller.num_threads == 8
+
+        for _ in range(10):
+            threadpool_limits(limits=3, user_api="my_threaded_lib")
+        assert lib_controller.num_threads == 3
+        assert not _limit_stack._libraries
+
+        # A limiter still held after its thread exited keeps its limits until it is
+        # restored
+        limiters = []
+        thread = threading.Thread(
+            target=lambda: limiters.append(controller.limit(limits=1))
+        )
+        thread.start()
+        thread.join()
+        assert lib_controller.num_threads == 1
+        with controller.limit(limits=16):
+            assert lib_controller.num_threads == 1
+        assert lib_controller.num_threads == 1
+        limiters[0].restore_original_limits()
+        assert lib_controller.num_threads == 3
+        assert not _limit_stack._libraries
+    finally:
+        lib_controller.set_num_threads(original_num_threads)
+
+
+def test_limits_leave_other_libraries_alone():
+    # Check that a limiter doesn't change the number of threads of the libraries it
+    # doesn't limit, even when they are changed while it is active.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    controller = ThreadpoolController().select(user_api="my_threaded_lib")
+    lib_controller = controller.lib_controllers[0]
+    original_num_threads = lib_controller.num_threads
+
+    try:
+        with threadpool_limits(limits=1, user_api="blas"):
+            lib_controller.set_num_threads(5)
+            with threadpool_limits(limits=1, user_api="blas"):
+                assert lib_controller.num_threads == 5
+            assert lib_controller.num_threads == 5
+        assert lib_controller.num_threads == 5
+
+        with threadpool_limits(limits={"blas": 1, "my_threaded_lib": None}):
+            lib_controller.set_num_threads(6)
+        assert lib_controller.num_threads == 6
+        assert not _limit_stack._libraries
+    finally:
+        lib_controller.set_num_threads(original_num_threads)
+
+
+def test_concurrent_limits():
+    # Check that limits entered from several threads are arbitrated and properly
+    # restored whatever the order in which they are exited.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    controller = ThreadpoolController().select(user_api="my_threaded_lib")
+    lib_controller = controller.lib_controllers[0]
+    original_num_threads = lib_controller.num_threads
+    entered, release = threading.Event(), threading.Event()
+
+    def limit_in_thread():
+        with controller.limit(limits=1):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=limit_in_thread)
+    thread.start()
+    entered.wait()
+    assert lib_controller.num_threads == 1
+
+    # The minimum of the limits requested by the different threads is used
+    limiter = controller.limit(limits=2)
+    assert lib_controller.num_threads == 1
+
+    # The first thread exits first: the limits of the main thread apply
+    release.set()
+    thread.join()
+    assert lib_controller.num_threads == 2
+
+    limiter.restore_original_limits()
+    assert lib_controller.num_threads == original_num_threads
+
+
+@pytest.mark.skipif(
+    not os.path.exists("/proc/self/maps"), reason="Requires /proc/self/maps"
+)
+def test_proc_maps_discovery_backend(monkeypatch):
+    # Check that the /proc/self/maps backend finds the same libraries as the
+    # dl_iterate_phdr backend.
+    monkeypatch.setenv("THREADPOOLCTL_DISCOVERY_BACKEND", "dl_iterate_phdr")
+    dl_iterate_phdr_info = ThreadpoolController().info()
+
+    monkeypatch.setenv("THREADPOOLCTL_DISCOVERY_BACKEND", "proc_maps")
+    proc_maps_info = ThreadpoolController().info()
+
+    assert sorted(proc_maps_info, key=lambda info: info["filepath"]) == sorted(
+        dl_iterate_phdr_info, key=lambda info: info["filepath"]
+    )
+
+
+@pytest.mark.skipif(
+    not os.path.exists("/proc/self/maps"), reason="Requires /proc/self/maps"
+)
+def test_discovery_backend_selection(monkeypatch):
+    # Check the selection of the backend used to find the loaded libraries.
+    monkeypatch.delenv("THREADPOOLCTL_DISCOVERY_BACKEND", raising=False)
+    assert ThreadpoolController._get_discovery_backend() == "dl_iterate_phdr"
+
+    monkeypatch.setenv("THREADPOOLCTL_DISCOVERY_BACKEND", "proc_maps")
+    assert ThreadpoolController._get_discovery_backend() == "proc_maps"
+
+    monkeypatch.setenv("THREADPOOLCTL_DISCOVERY_BACKEND", "auto")
+    assert ThreadpoolController._get_discovery_backend() in (
+        "dl_iterate_phdr",
+        "proc_maps",
+    )
+
+    monkeypatch.setenv("THREADPOOLCTL_DISCOVERY_BACKEND", "wrong")
+    with pytest.raises(ValueError, match="THREADPOOLCTL_DISCOVERY_BACKEND must be"):
+        ThreadpoolController._get_discovery_backend()
+
+
+@pytest.mark.skipif(
+    sys.platform in ("win32", "darwin") or "pyodide" in sys.modules,
+    reason="Requires dl_iterate_phdr",
+)
+def test_get_libc_without_find_library(monkeypatch):
+    # Check that the libc is resolved without calling find_library, which can spawn
+    # subprocesses.
+    import threadpoolctl
+
+    def find_library(name):
+        raise AssertionError("find_library should not be called")
+
+    monkeypatch.setattr(threadpoolctl, "find_library", find_library)
+    monkeypatch.delitem(ThreadpoolController._system_libraries, "libc", raising=False)
+
+    libc = ThreadpoolController._get_libc()
+    assert hasattr(libc, "dl_iterate_phdr")
+    assert ThreadpoolController._get_filepaths_with_dl_iterate_phdr()
+
+
+def test_prefix_index():
+    # Check that the prefix index matches the filenames like a linear scan of the
+    # prefixes of each controller class would.
+    class A:
+        filename_prefixes = ("liba", "libab")
+
+    class B:
+        filename_prefixes = ("libabc", "lib")
+
+    class C:
+        filename_prefixes = ("libc",)
+
+    index = _PrefixIndex([A, B, C])
+
+    assert index.match("libabc.so") == [(A, "liba"), (B, "libabc")]
+    assert index.match("libab.so") == [(A, "liba"), (B, "lib")]
+    assert index.match("libc.so.6") == [(B, "lib"), (C, "libc")]
+    assert index.match("ld-linux.so") == []
+    assert _PrefixIndex([]).match("libc.so.6") == []
+
+
+def test_prefix_index_invalidated_by_register(monkeypatch):
+    # Check that registering a new controller invalidates the cached prefix index.
+    import threadpoolctl
+
+    class MyController:
+        user_api = "my_api"
+        internal_api = "my_api"
+        filename_prefixes = ("libmy_prefix_index_test",)
+
+    for name in ("_ALL_CONTROLLERS", "_ALL_USER_APIS", "_ALL_INTERNAL_APIS"):
+        monkeypatch.setattr(threadpoolctl, name, list(getattr(threadpoolctl, name)))
+    monkeypatch.setattr(threadpoolctl, "_ALL_PREFIXES", list(_ALL_PREFIXES))
+
+    try:
+        assert _get_prefix_index().match("libmy_prefix_index_test.so") == []
+        threadpoolctl.register(MyController)
+        assert _get_prefix_index().match("libmy_prefix_index_test.so") == [
+            (MyController, "libmy_prefix_index_test")
+        ]
+    finally:
+        _get_prefix_index.cache_clear()
+
+
 def test_threadpool_limits_bad_input():
     # Check that appropriate errors are raised for invalid arguments
     match = re.escape(f"user_api must be either in {_ALL_USER_APIS} or None.")
@@ -297,6 +784,39 @@ def test_threadpool_limits_bad_input():
     ):
         threadpool_limits(limits=(1, 2, 3))
 
+    with pytest.raises(ValueError, match="scope must be either in"):
+        threadpool_limits(limits=1, scope="wrong")
+
+
+def test_threadpool_limits_thread_scope():
+    # Check that the thread scope only limits the OpenMP libraries, and only for the
+    # calling thread.
+    controller = ThreadpoolController()
+    openmp_controller = controller.select(internal_api="openmp")
+    if not openmp_controller:
+        pytest.skip("Requires an OpenMP library")
+    original_info = controller.info()
+
+    def get_info_in_thread():
+        result = []
+        thread = threading.Thread(target=lambda: result.append(controller.info()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    original_info_in_thread = get_info_in_thread()
+
+    with controller.limit(limits=1, scope="thread"):
+        for lib_controller, lib_info in zip(controller.lib_controllers, original_info):
+            if lib_controller.internal_api == "openmp":
+                assert lib_controller.num_threads == 1
+            else:
+                assert lib_controller.num_threads == lib_info["num_threads"]
+
+        assert get_info_in_thread() == original_info_in_thread
+
+    assert controller.info() == original_info
+
 
 @pytest.mark.skipif(
     not cython_extensions_compiled, reason="Requires cython extensions to be compiled"
@@ -547,6 +1067,125 @@ def test_libomp_libiomp_warning(recwarn):
     assert "multiple_openmp.md" in str(wm.message)
 
 
+def test_oversubscription_report(monkeypatch):
+    # Check the worst-case concurrency estimate and the hooks called when
+    # oversubscribed.
+    controller = ThreadpoolController()
+    monkeypatch.setattr(threadpoolctl, "available_cpus", lambda: 1000)
+
+    report = controller.oversubscription_report()
+    assert report["cpu_count"] == 1000
+    assert report["python_threads"] == threading.active_count()
+    assert [lib["filepath"] for lib in report["libraries"]] == [
+        lib_controller.filepath for lib_controller in controller.lib_controllers
+    ]
+
+    per_thread = [
+        lib["num_threads"] for lib in report["libraries"] if lib["pool"] == "per-thread"
+    ]
+    process_wide = [
+        lib["num_threads"] for lib in report["libraries"] if lib["pool"] == "process"
+    ]
+    assert report["max_concurrency"] == report["python_threads"] * max(
+        per_thread, default=1
+    ) + sum(n - 1 for n in process_wide)
+    assert not report["oversubscribed"]
+    assert report["suggested_limits"] == {}
+
+    # More running Python threads than CPUs
+    monkeypatch.setattr(threadpoolctl, "available_cpus", lambda: 1)
+    release = threading.Event()
+    threads = [threading.Thread(target=release.wait) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        reports = []
+        with pytest.warns(RuntimeWarning, match="threads can run concurrently"):
+            report = controller.oversubscription_report(
+                warn=True, callback=reports.append
+            )
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert report["oversubscribed"]
+    assert reports == [report]
+    assert all(num_threads == 1 for num_threads in report["suggested_limits"].values())
+
+
+def test_oversubscription_report_unknown_num_threads(monkeypatch):
+    # Check that the libraries whose number of threads is unknown are reported but
+    # not taken into account.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    controller = ThreadpoolController().select(user_api="my_threaded_lib")
+    [lib_controller] = controller.lib_controllers
+    monkeypatch.setattr(type(lib_controller), "get_num_threads", lambda self: None)
+    monkeypatch.setattr(threadpoolctl, "available_cpus", lambda: 1)
+
+    report = controller.oversubscription_report()
+    [lib] = report["libraries"]
+    assert lib["num_threads"] is None
+    assert lib["pool"] == "unknown"
+    assert report["max_concurrency"] == report["python_threads"]
+    assert report["suggested_limits"] == {}
+
+
+def test_tune(tmp_path):
+    # Check that tune picks the fastest number of threads and caches it.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    mylib_controller = ThreadpoolController().select(user_api="my_threaded_lib")
+    original_info = mylib_controller.info()
+    calls = []
+
+    def workload():
+        # Fastest with 3 threads
+        num_threads = mylib_controller.lib_controllers[0].num_threads
+        calls.append(num_threads)
+        time.sleep(0 if num_threads == 3 else 0.01)
+
+    cache_file = str(tmp_path / "tune.json")
+    kwargs = dict(user_api="my_threaded_lib", key="workload", cache_file=cache_file)
+    num_threads = tune(
+        workload, candidates=[4, 1, 2, 3], n_warmup=2, n_repeats=3, **kwargs
+    )
+    assert num_threads == 3
+    assert calls == [n for n in (1, 2, 3, 4) for _ in range(5)]
+    assert mylib_controller.info() == original_info
+
+    with open(cache_file) as f:
+        cache = json.load(f)
+    ((cache_key, entry),) = cache.items()
+    assert json.loads(cache_key) == [
+        "workload",
+        [["my_threaded_lib", "2.0", None, None]],
+    ]
+    assert entry["num_threads"] == 3
+    assert set(entry["timings"]) == {"1", "2", "3", "4"}
+
+    # The cached optimum is returned without running the workload
+    calls.clear()
+    assert tune(workload, candidates=[1, 2, 3, 4], **kwargs) == 3
+    assert calls == []
+
+    # Different workloads are cached separately
+    assert tune(workload, candidates=[3], **{**kwargs, "key": "other"}) == 3
+    assert calls == [3] * 6
+    with open(cache_file) as f:
+        assert len(json.load(f)) == 2
+
+    # No library to tune
+    assert tune(workload, user_api="wrong", cache_file=cache_file) is None
+
+
 def test_command_line_empty_or_system_openmp():
     # When the command line is called without arguments, no library should be
     # detected. The only exception is a system OpenMP library that can be
@@ -575,6 +1214,22 @@ def test_command_line_command_flag():
         assert lib_info in this_process_info
 
 
+def test_command_line_oversubscription_report():
+    output = subprocess.check_output(
+        [sys.executable, "-m", "threadpoolctl", "--oversubscription-report"]
+    )
+    report = json.loads(output.decode("utf-8"))
+    assert report["python_threads"] == 1
+    assert set(report) == {
+        "cpu_count",
+        "python_threads",
+        "libraries",
+        "max_concurrency",
+        "oversubscribed",
+        "suggested_limits",
+    }
+
+
 @pytest.mark.skipif(
     sys.version_info < (3, 7), reason="need recent subprocess.run options"
 )
@@ -711,6 +1366,10 @@ def test_flexiblas_switch():
     # at first mkl is not loaded in the CI jobs where this test runs
     assert len(controller.select(internal_api="mkl").lib_controllers) == 0
 
+    # Other controllers sharing the library controllers must not prevent the search
+    # of loaded shared libraries in this one after switching backend.
+    other_controller = ThreadpoolController()  # noqa
+
     # at first, only "OPENBLAS_CONDA" is loaded
     assert fb_controller.current_backend == "OPENBLAS_CONDA"
     assert fb_controller.loaded_backends == ["OPENBLAS_CONDA"]
@@ -764,6 +1423,301 @@ def test_threadpool_controller_as_decorator():
     assert ThreadpoolController().info() == original_info
 
 
+def test_wrap_generators_and_coroutines():
+    # Check that the limits of a decorated generator, coroutine or async generator are
+    # only set while its body is executing and not while it is suspended.
+    controller = ThreadpoolController()
+    original_info = controller.info()
+    with controller.limit(limits=1):
+        limited_info = controller.info()
+
+    @controller.wrap(limits=1)
+    def generator():
+        for i in range(3):
+            received = yield controller.info()
+            assert received == i
+        return "done"
+
+    gen = generator()
+    assert controller.info() == original_info
+    assert next(gen) == limited_info
+    assert controller.info() == original_info
+    assert gen.send(0) == limited_info
+    assert controller.info() == original_info
+    with pytest.raises(ValueError):
+        gen.throw(ValueError)
+    assert controller.info() == original_info
+
+    gen = generator()
+    results = list(itertools.chain([next(gen)], (gen.send(i) for i in range(2))))
+    assert results == [limited_info] * 3
+    with pytest.raises(StopIteration, match="done"):
+        gen.send(2)
+    assert controller.info() == original_info
+
+    @controller.wrap(limits=1)
+    async def coroutine(log):
+        for _ in range(3):
+            log.append(controller.info())
+            await asyncio.sleep(0)
+        return "done"
+
+    async def other_coroutine(log):
+        for _ in range(3):
+            log.append(controller.info())
+            await asyncio.sleep(0)
+
+    @controller.wrap(limits=1)
+    async def async_generator():
+        for _ in range(3):
+            yield controller.info()
+            await asyncio.sleep(0)
+
+    async def main():
+        limited_log, other_log = [], []
+        results = await asyncio.gather(
+            coroutine(limited_log), other_coroutine(other_log)
+        )
+        assert results == ["done", None]
+        assert limited_log == [limited_info] * 3
+        assert other_log == [original_info] * 3
+
+        async for info in async_generator():
+            assert info == limited_info
+            assert controller.info() == original_info
+
+        async with controller.limit(limits=1):
+            assert controller.info() == limited_info
+        assert controller.info() == original_info
+
+    asyncio.run(main())
+    assert controller.info() == original_info
+
+
+def _run_in_forked_child(func):
+    """Run func in a child process created with os.fork and return its result"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            os.close(read_fd)
+            try:
+                result = {"result": func()}
+            except BaseException as e:
+                result = {"error": repr(e)}
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(result, f)
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        result = json.load(f)
+    os.waitpid(pid, 0)
+    assert "error" not in result, result["error"]
+    return result["result"]
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "register_at_fork") or sys.platform != "linux",
+    reason="Requires os.fork and the generation counters of the dynamic loader",
+)
+@pytest.mark.filterwarnings("ignore:.*fork.*:DeprecationWarning")
+def test_fork(monkeypatch):
+    # Check that the library controllers are reused in a forked child process, that
+    # the limits set from the other threads are dropped and that the child limits
+    # are set.
+    controller = ThreadpoolController()
+    original_info = threadpool_info()
+    with controller.limit(limits=1):
+        limited_info = controller.info()
+
+    def child():
+        def load_libraries(self):
+            raise AssertionError("The loaded libraries should not be rescanned")
+
+        ThreadpoolController._load_libraries = load_libraries
+        return {
+            "info": threadpool_info(),
+            "frame_thread_ids": [
+                frame.thread_id
+                for _, _, frames in _limit_stack._libraries.values()
+                for frame, _ in frames
+            ],
+            "thread_id": threading.get_ident(),
+        }
+
+    entered, release = threading.Event(), threading.Event()
+
+    def limit_in_thread():
+        with threadpool_limits(limits=1):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=limit_in_thread)
+    thread.start()
+    entered.wait()
+    try:
+        result = _run_in_forked_child(child)
+    finally:
+        release.set()
+        thread.join()
+
+    assert result["info"] == original_info
+    assert all(
+        thread_id == result["thread_id"] for thread_id in result["frame_thread_ids"]
+    )
+
+    monkeypatch.setattr(threadpoolctl, "_child_limits", None)
+    set_child_limits(limits=1)
+    assert _run_in_forked_child(child)["info"] == limited_info
+    assert threadpool_info() == original_info
+
+    set_child_limits(limits=None)
+    assert _run_in_forked_child(child)["info"] == original_info
+
+    with pytest.raises(ValueError, match="user_api must be either in"):
+        set_child_limits(limits=1, user_api="wrong")
+
+
+def _make_cgroup_root(root, cgroup, files):
+    """Fake /proc/self/cgroup and /sys/fs/cgroup under a root directory"""
+    (root / "proc" / "self").mkdir(parents=True)
+    (root / "proc" / "self" / "cgroup").write_text(cgroup)
+    for path, content in files.items():
+        path = root / "sys" / "fs" / "cgroup" / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    return str(root)
+
+
+@pytest.mark.parametrize(
+    "cgroup, files, expected",
+    [
+        # cgroup v2, quota set on the cgroup of the process or on an ancestor
+        ("0::/\n", {"cpu.max": "200000 100000\n"}, 2),
+        ("0::/\n", {"cpu.max": "max 100000\n"}, None),
+        ("0::/a/b\n", {"a/b/cpu.max": "150000 100000\n"}, 2),
+        ("0::/a/b\n", {"a/cpu.max": "100000 100000", "a/b/cpu.max": "max 100000"}, 1),
+        # Cgroup of the process not visible: only the root is checked
+        ("0::/not/visible\n", {"cpu.max": "300000 100000\n"}, 3),
+        # cgroup v1
+        (
+            "4:memory:/\n3:cpu,cpuacct:/\n",
+            {
+                "cpu,cpuacct/cpu.cfs_quota_us": "50000\n",
+                "cpu,cpuacct/cpu.cfs_period_us": "100000\n",
+            },
+            1,
+        ),
+        (
+            "3:cpu,cpuacct:/docker/abc\n",
+            {
+                "cpu,cpuacct/docker/abc/cpu.cfs_quota_us": "-1\n",
+                "cpu,cpuacct/docker/abc/cpu.cfs_period_us": "100000\n",
+            },
+            None,
+        ),
+    ],
+)
+def test_available_cpus_cgroups(tmp_path, monkeypatch, cgroup, files, expected):
+    # Check that the CPU quota of the cgroups is taken into account.
+    for env_var in threadpoolctl._SCHEDULER_CPUS_ENV_VARS:
+        monkeypatch.delenv(env_var, raising=False)
+    monkeypatch.setattr(os, "process_cpu_count", lambda: 8, raising=False)
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)))
+
+    root = _make_cgroup_root(tmp_path, cgroup, files)
+    assert available_cpus(root=root) == (8 if expected is None else expected)
+
+
+def test_available_cpus_scheduler(tmp_path, monkeypatch):
+    # Check that the CPUs allocated by a batch scheduler are taken into account and
+    # that the smallest constraint wins.
+    for env_var in threadpoolctl._SCHEDULER_CPUS_ENV_VARS:
+        monkeypatch.delenv(env_var, raising=False)
+    monkeypatch.setattr(os, "process_cpu_count", lambda: 8, raising=False)
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)))
+    root = _make_cgroup_root(tmp_path, "0::/\n", {"cpu.max": "400000 100000\n"})
+
+    assert available_cpus(root=root) == 4
+    assert available_cpus(root=str(tmp_path / "missing")) == 8
+
+    monkeypatch.setenv("SLURM_CPUS_PER_TASK", "3")
+    assert available_cpus(root=root) == 3
+
+    monkeypatch.setenv("SLURM_CPUS_PER_TASK", "not a number")
+    assert available_cpus(root=root) == 4
+
+
+def test_threadpool_limits_auto(monkeypatch):
+    # Check that limits="auto" sets the number of threads to the available CPUs.
+    controller = ThreadpoolController()
+    original_info = controller.info()
+    monkeypatch.setattr(threadpoolctl, "available_cpus", lambda: 1)
+
+    with controller.limit(limits="auto"):
+        expected_info = controller.info()
+    with controller.limit(limits=1):
+        assert controller.info() == expected_info
+
+    assert controller.info() == original_info
+
+
+def _get_worker_limits():
+    return threadpool_info(), {
+        env_var: os.environ.get(env_var)
+        for env_var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+    }
+
+
+@pytest.mark.parametrize("n_workers", [1, 2, 4])
+def test_process_pool_executor(n_workers):
+    # Check that the workers of the pool split the CPUs between their thread pools,
+    # for the libraries already loaded and the ones loaded afterwards.
+    expected_num_threads = max(1, available_cpus() // n_workers)
+
+    with process_pool_executor(n_workers) as executor:
+        worker_info, env = executor.submit(_get_worker_limits).result()
+
+    assert all(
+        lib_info["num_threads"] == expected_num_threads
+        for lib_info in worker_info
+        # Only check the libraries that support changing their number of threads
+        if lib_info["internal_api"] in ("openblas", "mkl", "openmp")
+    )
+    assert env == {
+        env_var: str(expected_num_threads)
+        for env_var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+    }
+
+
+def test_wrap_by_size():
+    # Check that the limits of each call are chosen from the size of its problem.
+    controller = ThreadpoolController()
+    original_info = controller.info()
+    expected_info = {}
+    for limits in (1, 2):
+        with controller.limit(limits=limits):
+            expected_info[limits] = controller.info()
+
+    @controller.wrap_by_size(
+        size=lambda n, **kwargs: n,
+        thresholds={10: 1, 100: 2, 1000: None},
+    )
+    def func(n, extra=None):
+        """Docstring of func"""
+        return controller.info(), extra
+
+    assert func.__doc__ == "Docstring of func"
+    assert func(5) == (original_info, None)
+    assert func(10, extra="extra") == (expected_info[1], "extra")
+    assert func(99) == (expected_info[1], None)
+    assert func(100) == (expected_info[2], None)
+    assert func(10_000) == (original_info, None)
+    assert controller.info() == original_info
+
+
 def test_custom_controller():
     # Check that a custom controller can be used to change the number of threads
     # used by a library.
@@ -792,3 +1746,468 @@ def test_custom_controller():
         assert mylib_controller.num_threads == 1
 
     assert ThreadpoolController().info() == original_info
+
+
+def test_listeners(monkeypatch):
+    # Check that the listeners and the audit hooks receive the events of discovery,
+    # of each set_num_threads call and of entering and exiting the limits.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    events = []
+    audit_events = []
+    recording = threading.Event()
+
+    def listener(event, data):
+        events.append((event, data))
+
+    def audit_hook(event, args):
+        # Audit hooks can't be removed: only record during this test
+        if recording.is_set() and event.startswith("threadpoolctl."):
+            audit_events.append((event, args))
+
+    sys.addaudithook(audit_hook)
+    recording.set()
+    threadpoolctl.add_listener(listener)
+    try:
+        # Forget the controllers of the libraries to discover them again
+        monkeypatch.setattr(ThreadpoolController, "_lib_controllers_cache", {})
+        controller = ThreadpoolController().select(user_api="my_threaded_lib")
+        with controller.limit(limits=1):
+            pass
+    finally:
+        threadpoolctl.remove_listener(listener)
+        recording.clear()
+
+    assert [event for event, _ in audit_events] == [
+        f"threadpoolctl.{event}" for event, _ in events
+    ]
+
+    filepath = controller.lib_controllers[0].filepath
+    lib_controller = controller.lib_controllers[0]
+    assert (
+        "threadpoolctl.discovery",
+        (filepath, "my_threaded_lib", "my_threaded_lib", "my_threaded_lib"),
+    ) in audit_events
+    audit_events = [args for event, args in audit_events if "discovery" not in event]
+    limits_args = ((lib_controller,), (1,), threading.get_ident())
+    assert audit_events[0] == audit_events[3] == limits_args
+    assert audit_events[1][:4] == (filepath, "my_threaded_lib", 42, 1)
+    assert audit_events[2][:4] == (filepath, "my_threaded_lib", 1, 42)
+    discovery = [data for event, data in events if event == "discovery"]
+    assert {
+        "filepath": filepath,
+        "prefix": "my_threaded_lib",
+        "user_api": "my_threaded_lib",
+        "internal_api": "my_threaded_lib",
+    } in discovery
+
+    # The set_num_threads events happen between entering and exiting the limits
+    events = [(event, data) for event, data in events if event != "discovery"]
+    assert [event for event, _ in events] == [
+        "limits_enter",
+        "set_num_threads",
+        "set_num_threads",
+        "limits_exit",
+    ]
+    limits_data = {"limits": {filepath: 1}, "thread_id": threading.get_ident()}
+    assert events[0][1] == events[3][1] == limits_data
+
+    for (_, data), (old, new) in zip(events[1:3], [(42, 1), (1, 42)]):
+        assert data["filepath"] == filepath
+        assert data["internal_api"] == "my_threaded_lib"
+        assert (data["old_num_threads"], data["new_num_threads"]) == (old, new)
+        assert data["caller"].startswith(f"{__file__}:")
+        assert data["duration"] >= 0
+
+    # Removed listeners are not called anymore
+    with controller.limit(limits=1):
+        pass
+    assert len(events) == 4
+
+
+def test_listeners_reentrant():
+    # Check that the listeners can call threadpoolctl: they are only called once
+    # threadpoolctl released its locks.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    events = []
+
+    def listener(event, data):
+        threadpool_info()
+        info = ThreadpoolController().select(user_api="my_threaded_lib").info()
+        events.append((event, info[0]["num_threads"] if info else None))
+
+    def run():
+        with threadpool_limits(limits=1, user_api="my_threaded_lib"):
+            pass
+
+    with pytest.MonkeyPatch.context() as mp:
+        # Forget the controllers of the libraries to discover them again
+        mp.setattr(ThreadpoolController, "_lib_controllers_cache", {})
+        mp.setattr(ThreadpoolController, "_shared_instance", None)
+        threadpoolctl.add_listener(listener)
+        try:
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join(timeout=30)
+            assert not thread.is_alive(), "deadlock when calling threadpoolctl"
+        finally:
+            threadpoolctl.remove_listener(listener)
+
+    assert "discovery" in [event for event, _ in events]
+    events = [event for event in events if event[0] != "discovery"]
+    assert events == [
+        ("limits_enter", 1),
+        ("set_num_threads", 1),
+        ("set_num_threads", 42),
+        ("limits_exit", 42),
+    ]
+
+
+def test_listeners_bad_input():
+    # Check that failing listeners don't prevent setting the limits and that
+    # invalid listeners are rejected.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    def listener(event, data):
+        raise RuntimeError("failing listener")
+
+    controller = ThreadpoolController().select(user_api="my_threaded_lib")
+    threadpoolctl.add_listener(listener)
+    try:
+        with pytest.warns(RuntimeWarning, match="failing listener"):
+            with controller.limit(limits=1):
+                assert controller.info()[0]["num_threads"] == 1
+    finally:
+        threadpoolctl.remove_listener(listener)
+    assert controller.info()[0]["num_threads"] == 42
+
+    with pytest.raises(ValueError, match="is not a subscribed listener"):
+        threadpoolctl.remove_listener(listener)
+
+    with pytest.raises(TypeError, match="callback must be callable"):
+        threadpoolctl.add_listener("not a callable")
+
+
+def test_trace(tmp_path):
+    # Check that the limit changes are recorded and can be analyzed from the command
+    # line.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    controller = ThreadpoolController().select(user_api="my_threaded_lib")
+    filepath = controller.lib_controllers[0].filepath
+    trace_path = tmp_path / "trace.jsonl"
+
+    threadpoolctl.start_trace(trace_path)
+    try:
+        with pytest.raises(RuntimeError, match="already being recorded"):
+            threadpoolctl.start_trace(tmp_path / "other_trace.jsonl")
+        time.sleep(0.01)
+        with controller.limit(limits=1):
+            time.sleep(0.05)
+    finally:
+        threadpoolctl.stop_trace()
+    # Stopping again does nothing
+    threadpoolctl.stop_trace()
+
+    records = threadpoolctl._read_trace(trace_path)
+    assert [record["event"] for record in records] == [
+        "trace_start",
+        "limits_enter",
+        "set_num_threads",
+        "set_num_threads",
+        "limits_exit",
+        "trace_stop",
+    ]
+    for record in records:
+        assert record["pid"] == os.getpid()
+        assert record["tid"] == threading.get_ident()
+    assert records[1]["limits"] == {filepath: 1}
+    assert (records[2]["before"], records[2]["after"]) == (42, 1)
+    assert (records[3]["before"], records[3]["after"]) == (1, 42)
+
+    chrome_path = tmp_path / "trace.json"
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-m",
+            "threadpoolctl",
+            "trace",
+            str(trace_path),
+            "--chrome",
+            str(chrome_path),
+        ]
+    )
+    summary = json.loads(output.decode("utf-8"))
+    assert list(summary) == [filepath]
+    assert summary[filepath]["internal_api"] == "my_threaded_lib"
+    num_threads = summary[filepath]["num_threads"]
+    assert set(num_threads) == {"1", "42"}
+    assert num_threads["1"]["seconds"] >= 0.05
+    assert num_threads["42"]["seconds"] >= 0.01
+    # The time at 1 thread is attributed to the line that entered the limits
+    [caller] = num_threads["1"]["callers"]
+    assert caller.startswith(f"{__file__}:")
+
+    with open(chrome_path) as f:
+        trace_events = json.load(f)["traceEvents"]
+    counter_values = [
+        event["args"]["num_threads"] for event in trace_events if event["ph"] == "C"
+    ]
+    assert counter_values == [42, 1, 42]
+    assert [event["ph"] for event in trace_events if event["name"] == "limits"] == [
+        "B",
+        "E",
+    ]
+
+
+SPIN_WAIT_TARGET = """
+import _thread
+import json
+import threading
+import time
+
+from threadpoolctl import ThreadpoolController
+
+
+def start_spinner(start, stop):
+    # A thread started with _thread is not a Python thread known to the threading
+    # module, as the worker threads of the native thread pools.
+    tids = []
+
+    def spin():
+        tids.append(threading.get_native_id())
+        time.sleep(max(0, start - time.perf_counter()))
+        while time.perf_counter() < stop:
+            pass
+
+    _thread.start_new_thread(spin, ())
+    while not tids:
+        time.sleep(0.001)
+    return tids[0]
+
+
+controller = ThreadpoolController()
+reports = {}
+
+with controller.detect_spin_wait(duration=0.2) as detector:
+    pass
+reports["idle"] = detector.report
+
+# A thread that burns CPU after the block but not during it
+now = time.perf_counter()
+tid = start_spinner(start=now + 0.1, stop=now + 0.3)
+with controller.detect_spin_wait(duration=0.6) as detector:
+    pass
+reports["unrelated"] = tid, detector.report
+
+# A thread that works during the block and keeps spinning after it
+with controller.detect_spin_wait(duration=0.6) as detector:
+    now = time.perf_counter()
+    tid = start_spinner(start=now, stop=now + 0.3)
+    time.sleep(0.1)
+reports["spinning"] = tid, detector.report
+
+print(json.dumps(reports))
+"""
+
+
+@pytest.mark.skipif(
+    not os.path.isdir("/proc/self/task"), reason="requires /proc/self/task"
+)
+def test_detect_spin_wait():
+    # Check that a thread that works during the block and keeps burning CPU after it
+    # is reported as spinning, but not the idle threads, the threads that only burn
+    # CPU after the block and the Python threads. Run in a new process such that no
+    # worker thread from the other tests can spin.
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, "-c", SPIN_WAIT_TARGET],
+        env={**os.environ, "PYTHONPATH": repo_root},
+        text=True,
+    )
+    reports = json.loads(output)
+
+    report = reports["idle"]
+    assert report["duration"] >= 0.2
+    assert report["spinning"] is False
+    assert report["spinning_threads"] == []
+    assert report["cpu_seconds"] == 0
+    assert report["runtimes"] == []
+
+    _, report = reports["unrelated"]
+    assert report["spinning"] is False
+    assert report["spinning_threads"] == []
+
+    spinner_tid, report = reports["spinning"]
+    assert report["spinning"] is True
+    [spinning_thread] = report["spinning_threads"]
+    assert spinning_thread["tid"] == spinner_tid
+    assert 0 < spinning_thread["spin_duration"] < 0.6
+    assert report["cpu_seconds"] == spinning_thread["cpu_seconds"] > 0
+
+    # No report if the block raised
+    controller = ThreadpoolController()
+    with pytest.raises(ValueError):
+        with controller.detect_spin_wait() as detector:
+            raise ValueError
+    assert detector.report is None
+
+
+@pytest.mark.skipif(
+    not os.path.isdir("/proc/self/task"), reason="requires /proc/self/task"
+)
+def test_detect_spin_wait_runtimes(monkeypatch):
+    # Check that the runtimes that can spin-wait are reported as possible culprits,
+    # including when their number of threads is unknown.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    controller = ThreadpoolController().select(user_api="my_threaded_lib")
+    [lib_controller] = controller.lib_controllers
+    suggested_environment = {"OMP_WAIT_POLICY": "passive"}
+    monkeypatch.setattr(
+        threadpoolctl,
+        "_get_spin_wait_controls",
+        lambda lib_controller: ("gnu", suggested_environment),
+    )
+    monkeypatch.setenv("OMP_WAIT_POLICY", "active")
+
+    # A native thread burning a full CPU from the block onwards
+    clock = itertools.count()
+    monkeypatch.setattr(
+        threadpoolctl, "_read_threads_cpu_times", lambda: {-1: next(clock) * 10.0}
+    )
+
+    for num_threads in (4, None):
+        monkeypatch.setattr(
+            type(lib_controller), "get_num_threads", lambda self: num_threads
+        )
+        with controller.detect_spin_wait(duration=0.1, interval=0.01) as detector:
+            pass
+        assert detector.report["spinning"] is True
+        [runtime] = detector.report["runtimes"]
+        assert runtime["prefix"] == "my_threaded_lib"
+        assert runtime["num_threads"] == num_threads
+        assert runtime["runtime"] == "gnu"
+        assert runtime["environment"] == {"OMP_WAIT_POLICY": "active"}
+        assert runtime["suggested_environment"] == suggested_environment
+
+    # A single thread can't spin-wait for other threads
+    monkeypatch.setattr(type(lib_controller), "get_num_threads", lambda self: 1)
+    with controller.detect_spin_wait(duration=0.1, interval=0.01) as detector:
+        pass
+    assert detector.report["spinning"] is True
+    assert detector.report["runtimes"] == []
+
+
+RUN_TARGET = """
+import json
+import os
+import sys
+
+import tests._pyMylib
+from threadpoolctl import threadpool_info
+
+print(json.dumps({
+    "argv": sys.argv,
+    "env": os.environ.get("OMP_NUM_THREADS"),
+    "num_threads": {
+        lib_info["prefix"]: lib_info["num_threads"] for lib_info in threadpool_info()
+    },
+}))
+"""
+
+
+def _run_command(args, cwd, env=None):
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run(
+        [sys.executable, "-m", "threadpoolctl", "run", *args],
+        capture_output=True,
+        text=True,
+        cwd=cwd,
+        env={**os.environ, "PYTHONPATH": repo_root, **(env or {})},
+    )
+
+
+def test_command_line_run(tmp_path):
+    # Check that the run command sets the limits on the libraries loaded during the
+    # run of a script or of a module.
+    try:
+        import tests._pyMylib  # noqa
+    except:
+        pytest.skip("requires my_thread_lib to be compiled")
+
+    (tmp_path / "job.py").write_text(RUN_TARGET)
+
+    result = _run_command(
+        ["--limits", "openmp=2,my_threaded_lib=3", "--info-diff", "job.py", "-a"],
+        cwd=tmp_path,
+    )
+    assert result.returncode == 0, result.stderr
+    output = json.loads(result.stdout)
+    assert output["argv"] == ["job.py", "-a"]
+    assert output["env"] == "2"
+    assert output["num_threads"]["my_threaded_lib"] == 3
+
+    info_diff = json.loads(result.stderr)
+    [mylib_info] = [
+        lib_info
+        for lib_info in info_diff["loaded"]
+        if lib_info["prefix"] == "my_threaded_lib"
+    ]
+    assert mylib_info["num_threads"] == 3
+    assert info_diff["unloaded"] == []
+
+    result = _run_command(["--limits", "2", "-m", "job", "x"], cwd=tmp_path)
+    assert result.returncode == 0, result.stderr
+    output = json.loads(result.stdout)
+    assert output["argv"] == [str(tmp_path / "job.py"), "x"]
+    assert output["env"] == "2"
+    assert output["num_threads"]["my_threaded_lib"] == 2
+
+    # The exit code of the target is preserved
+    (tmp_path / "exit.py").write_text("raise SystemExit(3)")
+    assert _run_command(["exit.py"], cwd=tmp_path).returncode == 3
+
+    # The target shares the threadpoolctl module of the command: the trace is only
+    # started once and records the limits set by the command.
+    trace_path = tmp_path / "trace.jsonl"
+    result = _run_command(
+        ["--limits", "my_threaded_lib=3", "job.py"],
+        cwd=tmp_path,
+        env={"THREADPOOLCTL_TRACE": str(trace_path)},
+    )
+    assert result.returncode == 0, result.stderr
+    events = [record["event"] for record in threadpoolctl._read_trace(trace_path)]
+    assert events.count("trace_start") == events.count("trace_stop") == 1
+    assert "limits_enter" in events
+
+
+@pytest.mark.parametrize(
+    "args, match",
+    [
+        (["--limits", "blas:1", "job.py"], "limits must either be an int"),
+        (["--limits", "1", "--user-api", "wrong", "job.py"], "user_api must be"),
+        (["--limits", "1"], "a script or a module"),
+        (["-m"], "a script or a module"),
+    ],
+)
+def test_command_line_run_bad_input(tmp_path, args, match):
+    result = _run_command(args, cwd=tmp_path)
+    assert result.returncode == 2
+    assert match in result.stderr
@@ -14,14 +14,24 @@ maximal number of threads they can use.
 import os
 import re
 import sys
+import atexit
+import bisect
+import copy
 import ctypes
+import inspect
 import itertools
+import json
+import math
 import textwrap
+import threading
+import time
+import types
 from typing import final
 import warnings
+import weakref
 from ctypes.util import find_library
 from abc import ABC, abstractmethod
-from functools import lru_cache
+from functools import lru_cache, cached_property, wraps
 from contextlib import ContextDecorator
 
 __version__ = "3.7.0.dev0"
@@ -31,6 +41,16 @@ __all__ = [
     "ThreadpoolController",
     "LibController",
     "register",
+    "threadpool_limits_stats",
+    "worker_threadpool_limits",
+    "process_pool_executor",
+    "available_cpus",
+    "set_child_limits",
+    "tune",
+    "add_listener",
+    "remove_listener",
+    "start_trace",
+    "stop_trace",
 ]
 
 
@@ -59,9 +79,44 @@ class _dl_phdr_info(ctypes.Structure):
         ("dlpi_name", ctypes.c_char_p),  # path to the library
         ("dlpi_phdr", ctypes.c_void_p),  # pointer on dlpi_headers
         ("dlpi_phnum", _SYSTEM_UINT_HALF),  # number of elements in dlpi_phdr
+        ("dlpi_adds", ctypes.c_ulonglong),  # number of loads in the process
+        ("dlpi_subs", ctypes.c_ulonglong),  # number of unloads in the process
     ]
 
 
+# The dlpi_adds and dlpi_subs fields were added to the structure after the first
+# ones. dl_iterate_phdr passes the actual size of the structure to the callback which
+# allows to check whether they are available.
+_DL_PHDR_INFO_COUNTERS_SIZE = _dl_phdr_info.dlpi_subs.offset + ctypes.sizeof(
+    ctypes.c_ulonglong
+)
+
+_dl_iterate_phdr_callback_t = ctypes.CFUNCTYPE(
+    ctypes.c_int,  # Return type
+    ctypes.POINTER(_dl_phdr_info),
+    ctypes.c_size_t,
+    ctypes.c_char_p,
+)
+
+# Filenames of the GNU libc (libc.so.6, libc-2.31.so) and of the musl libc
+# (ld-musl-x86_64.so.1).
+_LIBC_FILENAME_RE = re.compile(r"libc\.so|libc-[0-9.]+\.so|ld-musl-")
+
+# Backends available to find the loaded libraries on Linux.
+_DISCOVERY_BACKENDS = ("dl_iterate_phdr", "proc_maps")
+
+# Lines of /proc/self/maps for file backed executable mappings. See
+# https://man7.org/linux/man-pages/man5/proc_pid_maps.5.html for the format of
+# each line: "address perms offset dev inode pathname". Each loaded library has at
+# least one executable mapping. An inode of 0 means that there is no backing file.
+_PROC_MAPS_EXECUTABLE_FILE_RE = re.compile(
+    rb"^\S+ ..x. \S+ \S+ [1-9][0-9]* +(/.*)$", flags=re.MULTILINE
+)
+
+
+# Sentinel for missing attributes, since None is a valid value.
+_MISSING = object()
+
 # The RTLD_NOLOAD flag for loading shared libraries is not defined on Windows.
 try:
     _RTLD_NOLOAD = os.RTLD_NOLOAD
@@ -87,6 +142,10 @@ class LibController(ABC):
     and implement the following methods: `get_num_threads`, `set_num_threads` and
     `get_version`.
 
+    The `info` method accepts an optional `fields` list of the entries to compute, see
+    below. Subclasses overriding `info` should accept it too: when they don't, the
+    full info dict is computed and the requested entries are picked from it.
+
     Threadpoolctl loops through all the loaded shared libraries and tries to match
     the filename of each library with the `filename_prefixes`. If a match is found, a
     controller is instantiated and a handler to the library is stored in the `dynlib`
@@ -102,29 +161,66 @@ class LibController(ABC):
       - version : version of the library (if available).
 
     In addition, each library controller may expose internal API specific entries. They
-    must be set as attributes in the `set_additional_attributes` method.
+    must be set as attributes in the `set_additional_attributes` method, or defined as
+    public `functools.cached_property` to only be computed the first time they are
+    requested.
     """
 
+    # Whether set_num_threads only changes the number of threads for the calling
+    # thread, e.g. omp_set_num_threads sets the nthreads-var ICV of the calling thread.
+    _per_thread_num_threads = False
+
     @final
     def __init__(self, *, filepath=None, prefix=None, parent=None):
         """This is not meant to be overriden by subclasses."""
         self.parent = parent
+        # The controllers holding this library controller, which is shared by all the
+        # ThreadpoolController instances that find the library, see `switch_backend`.
+        self._parents = weakref.WeakSet()
+        if parent is not None:
+            self._parents.add(parent)
         self.prefix = prefix
         self.filepath = filepath
         self.dynlib = ctypes.CDLL(filepath, mode=_RTLD_NOLOAD)
         self._symbol_prefix, self._symbol_suffix = self._find_affixes()
-        self.version = self.get_version()
         self.set_additional_attributes()
 
-    def info(self):
-        """Return relevant info wrapped in a dict"""
-        hidden_attrs = ("dynlib", "parent", "_symbol_prefix", "_symbol_suffix")
-        return {
-            "user_api": self.user_api,
-            "internal_api": self.internal_api,
-            "num_threads": self.num_threads,
-            **{k: v for k, v in vars(self).items() if k not in hidden_attrs},
-        }
+    @cached_property
+    def version(self):
+        """Version of the library, retrieved the first time it is requested"""
+        return self.get_version()
+
+    def info(self, fields=None):
+        """Return relevant info wrapped in a dict
+
+        If `fields` is a list of entries of the info dict, only these entries are
+        computed and returned. Entries that are not available for this library are
+        left out.
+        """
+        if fields is None:
+            fields = self._get_info_fields()
+
+        info = {}
+        for field in fields:
+            value = getattr(self, field, _MISSING)
+            if value is not _MISSING:
+                info[field] = value
+        return info
+
+    def _get_info_fields(self):
+        """Return the names of all the entries of the info dict"""
+        hidden_attrs = ("dynlib", "parent")
+        fields = [
+            "user_api",
+            "internal_api",
+            "num_threads",
+            "prefix",
+            "filepath",
+            *_get_lazy_attributes(type(self)),
+            *(k for k in vars(self) if k not in hidden_attrs and not k.startswith("_")),
+        ]
+        # Computed lazy attributes are also stored in the instance dict.
+        return list(dict.fromkeys(fields))
 
     def set_additional_attributes(self):
         """Set additional attributes meant to be exposed in the info dict"""
@@ -159,6 +255,35 @@ class LibController(ABC):
             self.dynlib, f"{self._symbol_prefix}{name}{self._symbol_suffix}", None
         )
 
+    def _get_typed_symbol(self, name, restype, argtypes):
+        """Return a new typed function for the symbol, None if it doesn't exist
+
+        Contrary to `_get_symbol`, the returned function object is not shared with
+        other callers so setting its restype and argtypes is safe.
+        """
+        try:
+            func = self.dynlib[f"{self._symbol_prefix}{name}{self._symbol_suffix}"]
+        except AttributeError:
+            return None
+        func.restype = restype
+        func.argtypes = argtypes
+        return func
+
+
+def _foreign_function(name, restype, *argtypes):
+    """Declare a typed function of the shared library as a LibController attribute
+
+    The symbol is resolved, accounting for the affixes, and typed only once, the first
+    time the attribute is accessed. It allows the get_num_threads and
+    set_num_threads hot paths to directly call the foreign function. The attribute
+    is None if the library does not expose the symbol.
+    """
+
+    def resolve(self):
+        return self._get_typed_symbol(name, restype, argtypes)
+
+    return cached_property(resolve)
+
 
 class OpenBLASController(LibController):
     """Controller class for OpenBLAS"""
@@ -183,20 +308,27 @@ class OpenBLASController(LibController):
             if hasattr(self.dynlib, f"{prefix}openblas_get_num_threads{suffix}"):
                 return prefix, suffix
 
-    def set_additional_attributes(self):
-        self.threading_layer = self._get_threading_layer()
-        self.architecture = self._get_architecture()
+    @cached_property
+    def threading_layer(self):
+        return self._get_threading_layer()
+
+    @cached_property
+    def architecture(self):
+        return self._get_architecture()
+
+    _get_num_threads_func = _foreign_function("openblas_get_num_threads", ctypes.c_int)
+    _set_num_threads_func = _foreign_function(
+        "openblas_set_num_threads", None, ctypes.c_int
+    )
 
     def get_num_threads(self):
-        get_num_threads_func = self._get_symbol("openblas_get_num_threads")
-        if get_num_threads_func is not None:
-            return get_num_threads_func()
+        if self._get_num_threads_func is not None:
+            return self._get_num_threads_func()
         return None
 
     def set_num_threads(self, num_threads):
-        set_num_threads_func = self._get_symbol("openblas_set_num_threads")
-        if set_num_threads_func is not None:
-            return set_num_threads_func(num_threads)
+        if self._set_num_threads_func is not None:
+            return self._set_num_threads_func(num_threads)
         return None
 
     def get_version(self):
@@ -248,22 +380,34 @@ class BLISController(LibController):
         "bli_arch_string",
     )
 
-    def set_additional_attributes(self):
-        self.threading_layer = self._get_threading_layer()
-        self.architecture = self._get_architecture()
+    @cached_property
+    def threading_layer(self):
+        return self._get_threading_layer()
+
+    @cached_property
+    def architecture(self):
+        return self._get_architecture()
+
+    # The number of threads is a BLIS dim_t, a 64 bits integer in the default builds
+    _get_num_threads_func = _foreign_function(
+        "bli_thread_get_num_threads", ctypes.c_int64
+    )
+    _set_num_threads_func = _foreign_function(
+        "bli_thread_set_num_threads", None, ctypes.c_int64
+    )
 
     def get_num_threads(self):
-        get_func = getattr(self.dynlib, "bli_thread_get_num_threads", lambda: None)
-        num_threads = get_func()
+        if self._get_num_threads_func is None:
+            return None
+        num_threads = self._get_num_threads_func()
         # by default BLIS is single-threaded and get_num_threads
         # returns -1. We map it to 1 for consistency with other libraries.
         return 1 if num_threads == -1 else num_threads
 
     def set_num_threads(self, num_threads):
-        set_func = getattr(
-            self.dynlib, "bli_thread_set_num_threads", lambda num_threads: None
-        )
-        return set_func(num_threads)
+        if self._set_num_threads_func is not None:
+            return self._set_num_threads_func(num_threads)
+        return None
 
     def get_version(self):
         get_version_ = getattr(self.dynlib, "bli_info_get_version_str", None)
@@ -318,31 +462,38 @@ class FlexiBLASController(LibController):
     def current_backend(self):
         return self._get_current_backend()
 
-    def info(self):
+    @cached_property
+    def available_backends(self):
+        return self._get_backend_list(loaded=False)
+
+    def info(self, fields=None):
         """Return relevant info wrapped in a dict"""
         # We override the info method because the loaded and current backends
         # are dynamic properties
-        exposed_attrs = super().info()
-        exposed_attrs["loaded_backends"] = self.loaded_backends
-        exposed_attrs["current_backend"] = self.current_backend
+        exposed_attrs = super().info(fields)
+        if fields is None:
+            exposed_attrs["loaded_backends"] = self.loaded_backends
+            exposed_attrs["current_backend"] = self.current_backend
 
         return exposed_attrs
 
-    def set_additional_attributes(self):
-        self.available_backends = self._get_backend_list(loaded=False)
+    _get_num_threads_func = _foreign_function("flexiblas_get_num_threads", ctypes.c_int)
+    _set_num_threads_func = _foreign_function(
+        "flexiblas_set_num_threads", None, ctypes.c_int
+    )
 
     def get_num_threads(self):
-        get_func = getattr(self.dynlib, "flexiblas_get_num_threads", lambda: None)
-        num_threads = get_func()
+        if self._get_num_threads_func is None:
+            return None
+        num_threads = self._get_num_threads_func()
         # by default BLIS is single-threaded and get_num_threads
         # returns -1. We map it to 1 for consistency with other libraries.
         return 1 if num_threads == -1 else num_threads
 
     def set_num_threads(self, num_threads):
-        set_func = getattr(
-            self.dynlib, "flexiblas_set_num_threads", lambda num_threads: None
-        )
-        return set_func(num_threads)
+        if self._set_num_threads_func is not None:
+            return self._set_num_threads_func(num_threads)
+        return None
 
     def get_version(self):
         get_version_ = getattr(self.dynlib, "flexiblas_get_version", None)
@@ -413,8 +564,10 @@ class FlexiBLASController(LibController):
                 )
 
             # Trigger a new search of loaded shared libraries since loading a new
-            # backend caused a dlopen.
-            self.parent._load_libraries()
+            # backend caused a dlopen, in all the controllers holding this one.
+            for parent in list(self._parents):
+                parent._load_libraries()
+                parent._send_discovery_events()
 
         switch_func = getattr(self.dynlib, "flexiblas_switch", lambda _: -1)
         idx = self.loaded_backends.index(backend)
@@ -436,16 +589,22 @@ class MKLController(LibController):
         "MKL_Set_Threading_Layer",
     )
 
-    def set_additional_attributes(self):
-        self.threading_layer = self._get_threading_layer()
+    @cached_property
+    def threading_layer(self):
+        return self._get_threading_layer()
+
+    _get_num_threads_func = _foreign_function("MKL_Get_Max_Threads", ctypes.c_int)
+    _set_num_threads_func = _foreign_function("MKL_Set_Num_Threads", None, ctypes.c_int)
 
     def get_num_threads(self):
-        get_func = getattr(self.dynlib, "MKL_Get_Max_Threads", lambda: None)
-        return get_func()
+        if self._get_num_threads_func is not None:
+            return self._get_num_threads_func()
+        return None
 
     def set_num_threads(self, num_threads):
-        set_func = getattr(self.dynlib, "MKL_Set_Num_Threads", lambda num_threads: None)
-        return set_func(num_threads)
+        if self._set_num_threads_func is not None:
+            return self._set_num_threads_func(num_threads)
+        return None
 
     def get_version(self):
         if not hasattr(self.dynlib, "MKL_Get_Version_String"):
@@ -490,19 +649,60 @@ class OpenMPController(LibController):
         "omp_get_num_threads",
     )
 
+    _get_num_threads_func = _foreign_function("omp_get_max_threads", ctypes.c_int)
+    _set_num_threads_func = _foreign_function("omp_set_num_threads", None, ctypes.c_int)
+    _per_thread_num_threads = True
+
     def get_num_threads(self):
-        get_func = getattr(self.dynlib, "omp_get_max_threads", lambda: None)
-        return get_func()
+        if self._get_num_threads_func is not None:
+            return self._get_num_threads_func()
+        return None
 
     def set_num_threads(self, num_threads):
-        set_func = getattr(self.dynlib, "omp_set_num_threads", lambda num_threads: None)
-        return set_func(num_threads)
+        if self._set_num_threads_func is not None:
+            return self._set_num_threads_func(num_threads)
+        return None
 
     def get_version(self):
         # There is no way to get the version number programmatically in OpenMP.
         return None
 
 
+@lru_cache(maxsize=None)
+def _get_lazy_attributes(controller_class):
+    """Return the names of the public cached properties of a LibController subclass
+
+    They are exposed in the info dict, from the base class to the subclass.
+    """
+    return tuple(
+        dict.fromkeys(
+            name
+            for klass in reversed(controller_class.__mro__)
+            for name, attr in vars(klass).items()
+            if isinstance(attr, cached_property) and not name.startswith("_")
+        )
+    )
+
+
+@lru_cache(maxsize=None)
+def _info_accepts_fields(controller_class):
+    """Whether the info method of a LibController subclass accepts `fields`
+
+    Third party controllers may override `info` without this parameter.
+    """
+    return "fields" in inspect.signature(controller_class.info).parameters
+
+
+def _get_lib_info(lib_controller, fields=None):
+    """Return the info dict of a library controller, restricted to `fields`"""
+    if fields is None:
+        return lib_controller.info()
+    if _info_accepts_fields(type(lib_controller)):
+        return lib_controller.info(fields=fields)
+    info = lib_controller.info()
+    return {field: info[field] for field in fields if field in info}
+
+
 # Controllers for the libraries that we'll look for in the loaded libraries.
 # Third party libraries can register their own controllers.
 _ALL_CONTROLLERS = [
@@ -523,6 +723,99 @@ _ALL_BLAS_LIBRARIES = [
     lib.internal_api for lib in _ALL_CONTROLLERS if lib.user_api == "blas"
 ]
 _ALL_OPENMP_LIBRARIES = OpenMPController.filename_prefixes
+_ALL_SCOPES = ("process", "thread")
+
+# Values of the threading_layer attribute of the library controllers meaning that the
+# library relies on OpenMP, or that it does not use threads.
+_OPENMP_THREADING_LAYERS = ("openmp", "intel", "gnu", "pgi")
+_SEQUENTIAL_THREADING_LAYERS = ("disabled", "sequential")
+
+
+class _PrefixIndex:
+    """Index mapping filename prefixes to the controller classes that declare them
+
+    A single anchored regex, built from a trie of the prefixes, quickly rejects the
+    filenames that do not start with any of the prefixes, which is the case of most of
+    the loaded shared libraries. The prefixes matched by the remaining filenames are
+    then looked up in a dict.
+    """
+
+    def __init__(self, controllers):
+        # {prefix: [(registration index, controller class), ...]}
+        self._candidates = {}
+        for idx, controller_class in enumerate(controllers):
+            for prefix in controller_class.filename_prefixes:
+                self._candidates.setdefault(prefix, []).append((idx, controller_class))
+
+        self._prefix_lengths = sorted(set(len(prefix) for prefix in self._candidates))
+
+        # The regex is built from a trie of the prefixes such that common leading
+        # characters (e.g. "lib") are only matched once.
+        trie = {}
+        for prefix in self._candidates:
+            node = trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        self._regex = re.compile(self._trie_to_pattern(trie))
+
+    @classmethod
+    def _trie_to_pattern(cls, node):
+        """Return a regex pattern matching the strings starting with a trie entry"""
+        if "" in node:
+            # A prefix ends here: whatever comes next, the filename matches.
+            return ""
+        alternatives = [
+            re.escape(char) + cls._trie_to_pattern(child)
+            for char, child in sorted(node.items())
+        ]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return f"(?:{'|'.join(alternatives)})"
+
+    def match(self, filename):
+        """Return the list of (controller_class, prefix) pairs matching filename
+
+        The pairs are sorted in the registration order of the controller classes and
+        the prefix of each pair is the first one of the `filename_prefixes` of the
+        controller class that filename starts with.
+        """
+        if not self._candidates or self._regex.match(filename) is None:
+            return []
+
+        matched_prefixes = set(
+            filename[:length]
+            for length in self._prefix_lengths
+            if filename[:length] in self._candidates
+        )
+        candidates = sorted(
+            set(
+                candidate
+                for prefix in matched_prefixes
+                for candidate in self._candidates[prefix]
+            ),
+            key=lambda candidate: candidate[0],
+        )
+        return [
+            (
+                controller_class,
+                next(
+                    p
+                    for p in controller_class.filename_prefixes
+                    if p in matched_prefixes
+                ),
+            )
+            for _, controller_class in candidates
+        ]
+
+
+@lru_cache(maxsize=None)
+def _get_prefix_index():
+    """Return the prefix index of the registered controllers
+
+    The index is cached and invalidated each time a new controller is registered.
+    """
+    return _PrefixIndex(_ALL_CONTROLLERS)
 
 
 def register(controller):
@@ -531,6 +824,7 @@ def register(controller):
     _ALL_USER_APIS.append(controller.user_api)
     _ALL_INTERNAL_APIS.append(controller.internal_api)
     _ALL_PREFIXES.extend(controller.filename_prefixes)
+    _get_prefix_index.cache_clear()
 
 
 def _format_docstring(*args, **kwargs):
@@ -549,7 +843,7 @@ def _realpath(filepath):
 
 
 @_format_docstring(USER_APIS=list(_ALL_USER_APIS), INTERNAL_APIS=_ALL_INTERNAL_APIS)
-def threadpool_info():
+def threadpool_info(fields=None):
     """Return the maximal number of threads for each detected library.
 
     Return a list with all the supported libraries that have been found. Each
@@ -563,8 +857,628 @@ def threadpool_info():
       - "num_threads": the current thread limit.
 
     In addition, each library may contain internal_api specific entries.
+
+    Parameters
+    ----------
+    fields : list of str or None (default=None)
+        The entries to include in the dict of each library. Only these entries are
+        computed, which avoids the cost of retrieving the version or other internal_api
+        specific entries when they are not needed. Entries that are not available for
+        a library are left out. If None, all the entries are included.
+    """
+    return ThreadpoolController._get_shared_instance().info(fields)
+
+
+# Number of set_num_threads calls issued and skipped by threadpool_limits and
+# ThreadpoolController.limit since the start of the process (or the last reset).
+_set_num_threads_stats = {
+    "set_num_threads_calls": 0,
+    "skipped_set_num_threads_calls": 0,
+}
+
+
+def _update_num_threads(lib_controller, current_num_threads, num_threads, events):
+    """Set the number of threads of a library only if it's different from the current
+
+    Setting the number of threads is not free for some libraries, e.g. it can trigger
+    a reconfiguration of the thread pool of OpenBLAS. The "set_num_threads" event is
+    appended to `events`, see `_send_events`.
+    """
+    if num_threads == current_num_threads:
+        _set_num_threads_stats["skipped_set_num_threads_calls"] += 1
+    else:
+        _set_num_threads_stats["set_num_threads_calls"] += 1
+        if _listeners:
+            start = time.perf_counter()
+            lib_controller.set_num_threads(num_threads)
+            duration = time.perf_counter() - start
+        else:
+            # Only measured for the listeners
+            lib_controller.set_num_threads(num_threads)
+            duration = None
+        events.append(
+            (
+                "set_num_threads",
+                (
+                    lib_controller.filepath,
+                    lib_controller.internal_api,
+                    current_num_threads,
+                    num_threads,
+                    duration,
+                ),
+            )
+        )
+
+
+# Callables subscribed with add_listener. They are called for each event sent by
+# _send_events, see add_listener for the list of events.
+_listeners = []
+
+# Files whose frames are skipped when looking for the caller of an event
+_INTERNAL_FILES = (__file__, inspect.getfile(ContextDecorator))
+
+
+def _send_events(events):
+    """Send events to the audit hooks and to the listeners
+
+    `events` is a list of `(event, args)` pairs where `args` are the arguments of the
+    audit event named "threadpoolctl.<event>". Events are often collected while the
+    locks of threadpoolctl are held: they must only be sent once the locks are
+    released, such that the audit hooks and listeners can call threadpoolctl.
+
+    The dict of data passed to the listeners is only built if there are listeners.
+    Exceptions raised by the listeners are turned into warnings, such that a failing
+    listener can't leave the limits half set.
+    """
+    if not _listeners:
+        for event, args in events:
+            sys.audit(_AUDIT_EVENTS[event], *args)
+        return
+    for event, args in events:
+        sys.audit(_AUDIT_EVENTS[event], *args)
+        data = _EVENT_DATA[event](*args)
+        for listener in list(_listeners):
+            try:
+                listener(event, data)
+            except Exception as e:
+                warnings.warn(
+                    f"Listener {listener!r} raised an exception on the event "
+                    f"{event!r}: {e!r}",
+                    RuntimeWarning,
+                )
+
+
+def _get_caller():
+    """Return "filename:lineno" of the innermost frame outside of threadpoolctl"""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename in _INTERNAL_FILES:
+        frame = frame.f_back
+    if frame is None:  # pragma: no cover
+        return None
+    return f"{frame.f_code.co_filename}:{frame.f_lineno}"
+
+
+def _get_discovery_data(filepath, prefix, user_api, internal_api):
+    return {
+        "filepath": filepath,
+        "prefix": prefix,
+        "user_api": user_api,
+        "internal_api": internal_api,
+    }
+
+
+def _get_limits_data(lib_controllers, limits, thread_id):
+    requested_limits = {
+        lib_controller.filepath: num_threads
+        for lib_controller, num_threads in zip(lib_controllers, limits)
+        if num_threads is not None
+    }
+    return {"limits": requested_limits, "thread_id": thread_id}
+
+
+def _get_set_num_threads_data(
+    filepath, internal_api, old_num_threads, new_num_threads, duration
+):
+    return {
+        "filepath": filepath,
+        "internal_api": internal_api,
+        "old_num_threads": old_num_threads,
+        "new_num_threads": new_num_threads,
+        # The events are sent before returning from the threadpoolctl call that
+        # triggered them: the caller is still on the stack.
+        "caller": _get_caller(),
+        "duration": duration,
+    }
+
+
+# Build the dict of data passed to the listeners from the arguments of the event
+_EVENT_DATA = {
+    "discovery": _get_discovery_data,
+    "limits_enter": _get_limits_data,
+    "limits_exit": _get_limits_data,
+    "set_num_threads": _get_set_num_threads_data,
+}
+_AUDIT_EVENTS = {event: f"threadpoolctl.{event}" for event in _EVENT_DATA}
+
+
+def add_listener(callback):
+    """Subscribe a callable to the events of threadpoolctl.
+
+    `callback(event, data)` is called with the name of the event and a dict holding
+    its data, in the thread that triggered the event. The events are:
+
+      - "discovery": a supported library is found for the first time in the process.
+        The data holds its "filepath", "prefix", "user_api" and "internal_api".
+      - "limits_enter": a limiter, e.g. `threadpool_limits`, sets its limits. The data
+        holds the "limits", a dict `{filepath: num_threads}` of the requested limits,
+        and the "thread_id" of the calling Python thread.
+      - "set_num_threads": the number of threads of a library is changed. The data
+        holds its "filepath" and "internal_api", the "old_num_threads" and
+        "new_num_threads", the "caller" as "filename:lineno" of the code that
+        triggered the change and the "duration" of the call in seconds.
+        Calls that are skipped because the library already uses the requested number
+        of threads are not reported.
+      - "limits_exit": a limiter restores the original limits. The data holds the
+        same entries as for "limits_enter".
+
+    The "set_num_threads" events triggered by a limiter are emitted between its
+    "limits_enter" and "limits_exit" events. The callback is called once threadpoolctl
+    released its locks, such that it can call threadpoolctl itself. Exceptions raised
+    by the callback are turned into warnings.
+
+    The same events are also raised as audit events named "threadpoolctl.<event>",
+    see `sys.addaudithook`. Their arguments are:
+
+      - "discovery": `(filepath, prefix, user_api, internal_api)`.
+      - "limits_enter" and "limits_exit": `(lib_controllers, limits, thread_id)`,
+        where `limits` holds the requested number of threads, or None, for each
+        library controller.
+      - "set_num_threads": `(filepath, internal_api, old_num_threads,
+        new_num_threads, duration)`, where duration is None if there are no
+        listeners.
+
+    Parameters
+    ----------
+    callback : callable
+        The callable to subscribe. Subscribing it several times makes it called
+        several times for each event.
+    """
+    if not callable(callback):
+        raise TypeError(f"callback must be callable. Got {callback!r} instead.")
+    _listeners.append(callback)
+
+
+def remove_listener(callback):
+    """Unsubscribe a callable subscribed with `add_listener`.
+
+    Raise a ValueError if the callable is not subscribed.
+    """
+    try:
+        _listeners.remove(callback)
+    except ValueError:
+        raise ValueError(f"{callback!r} is not a subscribed listener.") from None
+
+
+class _TraceRecorder:
+    """Listener writing the limit changes to a JSON lines file, see start_trace"""
+
+    def __init__(self, path):
+        self.path = path
+        # Line buffered such that a record is never split between processes when
+        # the file is shared with forked children.
+        self._file = open(path, "a", buffering=1)
+        self._write({"event": "trace_start"})
+
+    def __call__(self, event, data):
+        if event == "set_num_threads":
+            record = {
+                "event": event,
+                "filepath": data["filepath"],
+                "internal_api": data["internal_api"],
+                "before": data["old_num_threads"],
+                "after": data["new_num_threads"],
+                "caller": data["caller"],
+                "duration": data["duration"],
+            }
+        elif event in ("limits_enter", "limits_exit"):
+            record = {"event": event, "limits": data["limits"]}
+        else:
+            return
+        self._write(record)
+
+    def _write(self, record):
+        record = {
+            "ts": time.monotonic_ns(),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            **record,
+        }
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        # The limit stack lock is already held for most events and is reset in
+        # forked children.
+        with _limit_stack.lock:
+            self._file.write(line)
+
+    def close(self):
+        self._write({"event": "trace_stop"})
+        self._file.close()
+
+
+_trace_recorder = None
+
+
+def start_trace(path):
+    """Record the changes of limits to a file, until `stop_trace` is called.
+
+    Each limiter entered and exited, e.g. `threadpool_limits`, and each change of the
+    number of threads of a library is appended to the file as a JSON line, with the
+    monotonic timestamp in ns ("ts"), the process id ("pid") and the Python thread id
+    ("tid"). The number of threads changes hold the library ("filepath" and
+    "internal_api"), the number of threads before and after the change, the caller as
+    "filename:lineno" and the duration of the call in seconds.
+
+    The file is meant to be analyzed with ``python -m threadpoolctl trace <path>``
+    which summarizes the time spent at each number of threads per library and can
+    convert it to the Chrome trace format, viewable with Perfetto.
+
+    Recording can also be enabled for the whole lifetime of a process by setting the
+    THREADPOOLCTL_TRACE environment variable to the path of the file. Forked child
+    processes keep recording to the same file.
+
+    Parameters
+    ----------
+    path : str or path-like
+        The file to append the records to.
+    """
+    global _trace_recorder
+
+    with _limit_stack.lock:
+        if _trace_recorder is not None:
+            raise RuntimeError(
+                f"A trace is already being recorded to {_trace_recorder.path}."
+            )
+        _trace_recorder = _TraceRecorder(path)
+        add_listener(_trace_recorder)
+
+
+def stop_trace():
+    """Stop recording the changes of limits started with `start_trace`.
+
+    Does nothing if no trace is being recorded.
+    """
+    global _trace_recorder
+
+    with _limit_stack.lock:
+        if _trace_recorder is None:
+            return
+        remove_listener(_trace_recorder)
+        _trace_recorder.close()
+        _trace_recorder = None
+
+
+def threadpool_limits_stats(reset=False):
+    """Return the number of set_num_threads calls issued and skipped so far.
+
+    `threadpool_limits` and `ThreadpoolController.limit` only change the number of
+    threads of the libraries which are not already using the requested number of
+    threads, when setting the limits and when restoring the original limits.
+
+    Return a dict with the following entries:
+
+      - "set_num_threads_calls": the number of calls that were issued.
+      - "skipped_set_num_threads_calls": the number of calls that were skipped because
+        the library was already using the requested number of threads.
+
+    Parameters
+    ----------
+    reset : bool (default=False)
+        Whether to reset the counters to 0 after reading them.
+    """
+    with _limit_stack.lock:
+        stats = dict(_set_num_threads_stats)
+        if reset:
+            for key in _set_num_threads_stats:
+                _set_num_threads_stats[key] = 0
+    return stats
+
+
+class _LimitFrame:
+    """The limits requested by an active limiter
+
+    `lib_controllers` and `limits` are the arguments of the limiter: the requested
+    number of threads, or None, for each library controller. `entries` holds the
+    `(key, num_threads)` pairs of the libraries it limits, where the key identifies
+    the number of threads setting of a library, see `_LimitStack`.
+    """
+
+    def __init__(self, thread_id, entries, lib_controllers, limits):
+        self.thread_id = thread_id
+        self.entries = entries
+        self.lib_controllers = lib_controllers
+        self.limits = limits
+        self.active = True
+
+
+class _LimitStack:
+    """Process-wide stack of the limits requested by the active limiters
+
+    The number of threads of a library is a process-wide setting, while limiters can
+    be entered and exited concurrently from several Python threads, in any order. Each
+    limiter pushes a frame when setting its limits and pops it when restoring the
+    original limits, and the number of threads of each library is recomputed from the
+    remaining frames:
+
+      - within a Python thread, the innermost frame limiting a library wins, such that
+        nested limiters behave as they would without concurrency.
+      - across Python threads, the minimum of these limits is used.
+      - when no frame limits a library anymore, its number of threads is set back to
+        its value from before the first frame limiting it was pushed.
+
+    Only the libraries a frame limits are registered: the other libraries are never
+    changed by pushing or popping it.
+
+    Libraries whose number of threads is a per-thread setting, like OpenMP, are
+    tracked separately for each Python thread, such that the limits of a thread never
+    affect the other threads.
+
+    The frames of limiters discarded without restoring their limits are released, see
+    `release`.
+
+    The frames are indexed by library such that, in the common case where a single
+    frame limits a library, pushing and popping it does not depend on the other
+    frames.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # {key: [lib_controller, original num_threads, [(frame, num_threads), ...]]}
+        # where the frames limiting the library are in the order they were pushed.
+        # The key identifies the number of threads setting of a library: its filepath
+        # and the id of the Python thread for libraries with a per-thread setting.
+        self._libraries = {}
+
+    def push(self, lib_controllers, limits):
+        """Push a frame and set the resulting limits
+
+        `limits` holds the requested number of threads, or None, for each library
+        controller. Return the frame and the number of threads of each library from
+        before pushing the frame.
+        """
+        thread_id = threading.get_ident()
+        entries = []
+        frame = _LimitFrame(thread_id, entries, lib_controllers, limits)
+        events = [("limits_enter", (lib_controllers, limits, thread_id))]
+        current = []
+
+        with self.lock:
+            for lib_controller, num_threads in zip(lib_controllers, limits):
+                current_num_threads = lib_controller.get_num_threads()
+                current.append(current_num_threads)
+                if num_threads is None:
+                    continue
+                key = (
+                    lib_controller.filepath,
+                    thread_id if lib_controller._per_thread_num_threads else None,
+                )
+                entries.append((key, num_threads))
+                library = self._libraries.get(key)
+                if library is None:
+                    # No other frame limits this library
+                    self._libraries[key] = [
+                        lib_controller,
+                        current_num_threads,
+                        [(frame, num_threads)],
+                    ]
+                    new_num_threads = num_threads
+                else:
+                    library[2].append((frame, num_threads))
+                    new_num_threads = self._get_limit(library[2])
+                _update_num_threads(
+                    lib_controller, current_num_threads, new_num_threads, events
+                )
+        _send_events(events)
+        return frame, current
+
+    def pop(self, frame):
+        """Remove a frame, wherever it is in the stack, and update the limits"""
+        events = []
+        with self.lock:
+            self._pop(frame, events)
+        _send_events(events)
+
+    def release(self, frame):
+        """Remove the frame of a limiter discarded without restoring its limits
+
+        This is the case of a limiter used as a callable, e.g.
+        `threadpool_limits(limits=1)`. Its limits are kept, as if the number of
+        threads of the libraries was set directly: they replace the limits of the
+        enclosing frame of the same thread if any, or become the values restored
+        when no frame limits the libraries anymore.
+        """
+        events = []
+        with self.lock:
+            if not frame.active:
+                return
+            for key, num_threads in frame.entries:
+                library = self._libraries[key]
+                frames = library[2]
+                index = next(i for i, (f, _) in enumerate(frames) if f is frame)
+                for i in range(index - 1, -1, -1):
+                    if frames[i][0].thread_id == frame.thread_id:
+                        frames[i] = (frames[i][0], num_threads)
+                        break
+                else:
+                    library[1] = num_threads
+            self._pop(frame, events)
+        _send_events(events)
+
+    def _pop(self, frame, events):
+        """Remove a frame with the lock held, appending the events to `events`"""
+        if not frame.active:
+            # The limits of this frame were already restored
+            return
+        frame.active = False
+        for key, _ in frame.entries:
+            lib_controller, original_num_threads, frames = self._libraries[key]
+            if frames[-1][0] is frame:
+                frames.pop()
+            else:
+                index = next(i for i, (f, _) in enumerate(frames) if f is frame)
+                del frames[index]
+
+            if frames:
+                num_threads = self._get_limit(frames)
+            else:
+                del self._libraries[key]
+                num_threads = original_num_threads
+            if key[1] is not None and key[1] != threading.get_ident():
+                # Per-thread setting of another thread, e.g. when the frame of a
+                # discarded limiter is released by the garbage collector. It can't be
+                # changed from this thread.
+                continue
+            _update_num_threads(
+                lib_controller,
+                lib_controller.get_num_threads(),
+                num_threads,
+                events,
+            )
+        events.append(
+            ("limits_exit", (frame.lib_controllers, frame.limits, frame.thread_id))
+        )
+
+    def _reset_after_fork(self):
+        """Drop the frames of the threads that do not exist in a forked child
+
+        Only the thread that called fork exists in the child process. The limits of
+        the other threads no longer apply: the number of threads of the libraries is
+        recomputed from the remaining frames. Return the events to send.
+        """
+        self.lock = threading.RLock()
+        thread_id = threading.get_ident()
+        events = []
+
+        for key, library in list(self._libraries.items()):
+            lib_controller, original_num_threads, frames = library
+            for frame, _ in frames:
+                if frame.thread_id != thread_id:
+                    frame.active = False
+            library[2] = frames = [
+                (frame, num_threads)
+                for frame, num_threads in frames
+                if frame.thread_id == thread_id
+            ]
+            if frames:
+                num_threads = self._get_limit(frames)
+            else:
+                del self._libraries[key]
+                num_threads = original_num_threads
+            if key[1] is not None and key[1] != threading.get_ident():
+                # Per-thread setting of a thread that does not exist anymore
+                continue
+            _update_num_threads(
+                lib_controller, lib_controller.get_num_threads(), num_threads, events
+            )
+        return events
+
+    @staticmethod
+    def _get_limit(frames):
+        """Number of threads of a library resulting from its non-empty frames"""
+        if len(frames) == 1:
+            return frames[0][1]
+        limits = {}
+        for frame, num_threads in reversed(frames):
+            limits.setdefault(frame.thread_id, num_threads)
+        return min(limits.values())
+
+
+_limit_stack = _LimitStack()
+
+
+class _LimitPlan:
+    """Limits compiled by ThreadpoolController.compile_limits
+
+    Holds the pre-resolved `(lib_controller, num_threads)` pairs, where num_threads is
+    None for the libraries that are selected but not limited, and are left untouched.
+    Entering the plan only has to push these pairs on the limit stack.
+
+    A plan can be entered any number of times, including in nested `with` blocks or
+    concurrently from several threads.
+    """
+
+    def __init__(self, lib_controllers, limits):
+        self._lib_controllers = tuple(lib_controllers)
+        self._limits = tuple(limits)
+        self._local = threading.local()
+
+    @property
+    def limits(self):
+        """Tuple of the `(lib_controller, num_threads)` pairs of this plan"""
+        return tuple(zip(self._lib_controllers, self._limits))
+
+    def __enter__(self):
+        frame, _ = _limit_stack.push(self._lib_controllers, self._limits)
+        try:
+            self._local.frames.append(frame)
+        except AttributeError:
+            self._local.frames = [frame]
+        return self
+
+    def __exit__(self, type, value, traceback):
+        _limit_stack.pop(self._local.frames.pop())
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, type, value, traceback):
+        self.__exit__(type, value, traceback)
+
+    def __repr__(self):
+        limits = ", ".join(
+            f"{lib_controller.prefix}: {num_threads}"
+            for lib_controller, num_threads in self.limits
+            if num_threads is not None
+        )
+        return f"<{self.__class__.__name__} {{{limits}}}>"
+
+    def _push(self):
+        """Push the limits of this plan on the limit stack
+
+        Return the frame and the number of threads of each library from before
+        pushing the frame.
+        """
+        return _limit_stack.push(self._lib_controllers, self._limits)
+
+
+@types.coroutine
+def _run_with_limits(plan, gen):
+    """Run a generator or a coroutine with the limits of a plan
+
+    The limits are only set while the body of `gen` is executing: they are set
+    before each time it is resumed and restored each time it is suspended at a
+    `yield` or an `await`. Can be used with `yield from` for generators and with
+    `await` for coroutines.
     """
-    return ThreadpoolController().info()
+    value, exc = None, None
+    while True:
+        with plan:
+            try:
+                if exc is None:
+                    output = gen.send(value)
+                else:
+                    output = gen.throw(exc)
+            except StopIteration as e:
+                return e.value
+            finally:
+                # Break the reference cycle through the traceback of exc
+                exc = None
+        try:
+            value = yield output
+        except GeneratorExit:
+            with plan:
+                gen.close()
+            raise
+        except BaseException as e:
+            exc = e
 
 
 class _ThreadpoolLimiter:
@@ -578,12 +1492,12 @@ class _ThreadpoolLimiter:
     that it can be used as a decorator.
     """
 
-    def __init__(self, controller, *, limits=None, user_api=None):
-        self._controller = controller
+    def __init__(self, controller, *, limits=None, user_api=None, scope="process"):
+        self._controller = self._get_scoped_controller(controller, scope)
         self._limits, self._user_api, self._prefixes = self._check_params(
             limits, user_api
         )
-        self._original_info = self._controller.info()
+        self._plan = self._compile()
         self._set_threadpool_limits()
 
     def __enter__(self):
@@ -592,23 +1506,52 @@ class _ThreadpoolLimiter:
     def __exit__(self, type, value, traceback):
         self.restore_original_limits()
 
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, type, value, traceback):
+        self.__exit__(type, value, traceback)
+
     @classmethod
-    def wrap(cls, controller, *, limits=None, user_api=None):
+    def wrap(cls, controller, *, limits=None, user_api=None, scope="process"):
         """Return an instance of this class that can be used as a decorator"""
         return _ThreadpoolLimiterDecorator(
-            controller=controller, limits=limits, user_api=user_api
+            controller=controller, limits=limits, user_api=user_api, scope=scope
         )
 
+    def __del__(self):
+        # A limiter discarded without restoring its limits, e.g. used as a callable,
+        # keeps them but its frame must not outlive it, see `_LimitStack.release`.
+        frame = getattr(self, "_frame", None)
+        if frame is not None and frame.active:
+            _limit_stack.release(frame)
+
     def restore_original_limits(self):
-        """Set the limits back to their original values"""
-        for lib_controller, original_info in zip(
-            self._controller.lib_controllers, self._original_info
-        ):
-            lib_controller.set_num_threads(original_info["num_threads"])
+        """Set the limits back to their original values
+
+        If limiters were entered concurrently from other threads and are still
+        active, the limits are set to the values resulting from these limiters instead
+        (see `_LimitStack`).
+        """
+        _limit_stack.pop(self._frame)
 
     # Alias of `restore_original_limits` for backward compatibility
     unregister = restore_original_limits
 
+    @property
+    def _original_info(self):
+        """Info dicts of the library controllers from before setting the limits
+
+        Only the number of threads of each library is recorded when setting the
+        limits. The full info dicts are only built when requested.
+        """
+        return [
+            {**lib_controller.info(), "num_threads": num_threads}
+            for lib_controller, num_threads in zip(
+                self._controller.lib_controllers, self._original_num_threads
+            )
+        ]
+
     def get_original_num_threads(self):
         """Original num_threads from before calling threadpool_limits
 
@@ -619,9 +1562,11 @@ class _ThreadpoolLimiter:
 
         for user_api in self._user_api:
             limits = [
-                lib_info["num_threads"]
-                for lib_info in self._original_info
-                if lib_info["user_api"] == user_api
+                original_num_threads
+                for lib_controller, original_num_threads in zip(
+                    self._controller.lib_controllers, self._original_num_threads
+                )
+                if lib_controller.user_api == user_api
             ]
             limits = set(limits)
             n_limits = len(limits)
@@ -645,6 +1590,23 @@ class _ThreadpoolLimiter:
 
         return num_threads
 
+    @staticmethod
+    def _get_scoped_controller(controller, scope):
+        """Controller holding the library controllers affected by the given scope"""
+        if scope == "process":
+            return controller
+        if scope == "thread":
+            # Only the libraries whose number of threads is a per-thread setting can
+            # be limited for the current thread alone.
+            return ThreadpoolController._from_controllers(
+                [
+                    lib_controller
+                    for lib_controller in controller.lib_controllers
+                    if lib_controller._per_thread_num_threads
+                ]
+            )
+        raise ValueError(f"scope must be either in {_ALL_SCOPES}. Got {scope} instead.")
+
     def _check_params(self, limits, user_api):
         """Suitable values for the _limits, _user_api and _prefixes attributes"""
 
@@ -653,6 +1615,8 @@ class _ThreadpoolLimiter:
                 limits,
                 user_api,
             ) = self._controller._get_params_for_sequential_blas_under_openmp().values()
+        elif isinstance(limits, str) and limits == "auto":
+            limits = available_cpus()
 
         if limits is None or isinstance(limits, int):
             if user_api is None:
@@ -685,8 +1649,8 @@ class _ThreadpoolLimiter:
 
             if not isinstance(limits, dict):
                 raise TypeError(
-                    "limits must either be an int, a list, a dict, or "
-                    f"'sequential_blas_under_openmp'. Got {type(limits)} instead"
+                    "limits must either be an int, a list, a dict, or one of 'auto' "
+                    f"and 'sequential_blas_under_openmp'. Got {type(limits)} instead"
                 )
 
             # With a dictionary, can set both specific limit for given
@@ -696,47 +1660,102 @@ class _ThreadpoolLimiter:
 
         return limits, user_api, prefixes
 
-    def _set_threadpool_limits(self):
-        """Change the maximal number of threads in selected thread pools.
-
-        Return a list with all the supported libraries that have been found
-        matching `self._prefixes` and `self._user_api`.
-        """
-        if self._limits is None:
-            return
-
+    def _compile(self):
+        """Resolve the requested number of threads of each library controller"""
+        num_threads_limits = []
         for lib_controller in self._controller.lib_controllers:
             # self._limits is a dict {key: num_threads} where key is either
             # a prefix or a user_api. If a library matches both, the limit
             # corresponding to the prefix is chosen.
-            if lib_controller.prefix in self._limits:
+            if self._limits is None:
+                num_threads = None
+            elif lib_controller.prefix in self._limits:
                 num_threads = self._limits[lib_controller.prefix]
-            elif lib_controller.user_api in self._limits:
-                num_threads = self._limits[lib_controller.user_api]
             else:
-                continue
+                num_threads = self._limits.get(lib_controller.user_api)
+            num_threads_limits.append(num_threads)
+        return _LimitPlan(self._controller.lib_controllers, num_threads_limits)
 
-            if num_threads is not None:
-                lib_controller.set_num_threads(num_threads)
+    def _set_threadpool_limits(self):
+        """Change the maximal number of threads in selected thread pools.
+
+        The limits are pushed on the process-wide limit stack and the original number
+        of threads of each library controller is recorded.
+        """
+        self._frame, self._original_num_threads = self._plan._push()
 
 
 class _ThreadpoolLimiterDecorator(_ThreadpoolLimiter, ContextDecorator):
     """Same as _ThreadpoolLimiter but to be used as a decorator"""
 
-    def __init__(self, controller, *, limits=None, user_api=None):
+    def __init__(self, controller, *, limits=None, user_api=None, scope="process"):
+        self._controller = self._get_scoped_controller(controller, scope)
         self._limits, self._user_api, self._prefixes = self._check_params(
             limits, user_api
         )
-        self._controller = controller
+        self._plan = self._compile()
 
     def __enter__(self):
         # we need to set the limits here and not in the __init__ because we want the
         # limits to be set when calling the decorated function, not when creating the
         # decorator.
-        self._original_info = self._controller.info()
         self._set_threadpool_limits()
         return self
 
+    def _recreate_cm(self):
+        # Each call of the decorated function needs its own frame on the limit stack
+        # since the function can be called concurrently from several threads or
+        # recursively.
+        return copy.copy(self)
+
+    def __call__(self, func):
+        # Calling a coroutine function or a (async) generator function only creates
+        # the coroutine or the generator, which runs later, possibly interleaved with
+        # other ones. The limits are then set each time its body is resumed and
+        # restored each time it is suspended.
+        plan = self._plan
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                return await _run_with_limits(plan, func(*args, **kwargs))
+
+        elif inspect.isasyncgenfunction(func):
+
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                agen = func(*args, **kwargs)
+                value, exc = None, None
+                while True:
+                    try:
+                        if exc is None:
+                            step = agen.asend(value)
+                        else:
+                            step = agen.athrow(exc)
+                            exc = None
+                        output = await _run_with_limits(plan, step)
+                    except StopAsyncIteration:
+                        return
+                    try:
+                        value = yield output
+                    except GeneratorExit:
+                        await _run_with_limits(plan, agen.aclose())
+                        raise
+                    except BaseException as e:
+                        exc = e
+
+        elif inspect.isgeneratorfunction(func):
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                return (yield from _run_with_limits(plan, func(*args, **kwargs)))
+
+        else:
+            return super().__call__(func)
+
+        return wrapper
+
 
 @_format_docstring(
     USER_APIS=", ".join(f'"{api}"' for api in _ALL_USER_APIS),
@@ -747,21 +1766,27 @@ class threadpool_limits(_ThreadpoolLimiter):
     """Change the maximal number of threads that can be used in thread pools.
 
     This object can be used either as a callable (the construction of this object
-    limits the number of threads), as a context manager in a `with` block to
-    automatically restore the original state of the controlled libraries when exiting
-    the block, or as a decorator through its `wrap` method.
+    limits the number of threads), as a context manager in a `with` or `async with`
+    block to automatically restore the original state of the controlled libraries when
+    exiting the block, or as a decorator through its `wrap` method.
+
+    The limits of an `async with` block are set when entering it and restored when
+    exiting it: they also apply to the other tasks run by the event loop thread while
+    the block is suspended at an `await`. Use `threadpool_limits.wrap` to decorate a
+    coroutine function instead to limit only the task running it.
 
     Set the maximal number of threads that can be used in thread pools used in
     the supported libraries to `limit`. This function works for libraries that
     are already loaded in the interpreter and can be changed dynamically.
 
-    This effect is global and impacts the whole Python process. There is no thread level
-    isolation as these libraries do not offer thread-local APIs to configure the number
-    of threads to use in nested parallel calls.
+    By default, this effect is global and impacts the whole Python process. Most of
+    these libraries do not offer thread-local APIs to configure the number of threads
+    to use in nested parallel calls. OpenMP is an exception: `scope="thread"` limits
+    the OpenMP libraries for the calling thread only.
 
     Parameters
     ----------
-    limits : int, dict, 'sequential_blas_under_openmp' or None (default=None)
+    limits : int, dict, str or None (default=None)
         The maximal number of threads that can be used in thread pools
 
         - If int, sets the maximum number of threads to `limits` for each
@@ -776,6 +1801,11 @@ class threadpool_limits(_ThreadpoolLimiter):
           calls within an OpenMP parallel region. The `user_api` parameter is
           ignored.
 
+        - If 'auto', sets the maximum number of threads to the number of CPUs the
+          process can use, as returned by `available_cpus`, for each library
+          selected by `user_api`. It accounts for the CPU quota of containers and
+          for the CPUs allocated by batch schedulers.
+
         - If None, this function does not do anything.
 
     user_api : {USER_APIS} or None (default=None)
@@ -788,14 +1818,169 @@ class threadpool_limits(_ThreadpoolLimiter):
           by the BLAS libraries if they rely on OpenMP.
 
         - If None, this function will apply to all supported libraries.
-    """
 
-    def __init__(self, limits=None, user_api=None):
-        super().__init__(ThreadpoolController(), limits=limits, user_api=user_api)
+    scope : "process" or "thread" (default="process")
+        The extent of the limits.
+
+        - If "process", the limits apply to the whole Python process.
+
+        - If "thread", only the OpenMP libraries ({OPENMP_LIBS}) are limited, and
+          only for the calling thread, since their number of threads is a per-thread
+          setting. The other libraries and the other threads are left untouched.
+    """
+
+    def __init__(self, limits=None, user_api=None, scope="process"):
+        super().__init__(
+            ThreadpoolController._get_shared_instance(),
+            limits=limits,
+            user_api=user_api,
+            scope=scope,
+        )
 
     @classmethod
-    def wrap(cls, limits=None, user_api=None):
-        return super().wrap(ThreadpoolController(), limits=limits, user_api=user_api)
+    def wrap(cls, limits=None, user_api=None, scope="process"):
+        return super().wrap(
+            ThreadpoolController._get_shared_instance(),
+            limits=limits,
+            user_api=user_api,
+            scope=scope,
+        )
+
+
+def _read_threads_cpu_times():
+    """Return the CPU time in seconds of each thread of the process, by native id
+
+    Read from /proc/self/task/<tid>/stat, with the resolution of a clock tick.
+    """
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    cpu_times = {}
+    for tid in os.listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{tid}/stat") as f:
+                stat = f.read()
+        except OSError:
+            # The thread exited in the meantime
+            continue
+        # The command name, between parentheses, can contain spaces. The utime and
+        # stime fields are the 14th and 15th fields, i.e. the 12th and 13th after it.
+        fields = stat[stat.rindex(")") + 2 :].split()
+        cpu_times[int(tid)] = (int(fields[11]) + int(fields[12])) / clock_ticks
+    return cpu_times
+
+
+def _get_spin_wait_controls(lib_controller):
+    """Return the runtime of a library whose threads can spin-wait, and its controls
+
+    Return None if the threads of this library do not spin-wait on their own, e.g.
+    because they rely on an OpenMP runtime which is reported separately.
+    """
+    threading_layer = getattr(lib_controller, "threading_layer", None)
+    if lib_controller.prefix == "libgomp":
+        return "gnu", {"OMP_WAIT_POLICY": "passive", "GOMP_SPINCOUNT": "0"}
+    if lib_controller.prefix in ("libiomp", "libomp"):
+        runtime = "intel" if lib_controller.prefix == "libiomp" else "llvm"
+        return runtime, {"KMP_BLOCKTIME": "0", "OMP_WAIT_POLICY": "passive"}
+    if lib_controller.internal_api == "openblas" and threading_layer == "pthreads":
+        # The timeout is 2 ** OPENBLAS_THREAD_TIMEOUT cycles, 4 being the minimum.
+        return "openblas", {"OPENBLAS_THREAD_TIMEOUT": "4"}
+    return None
+
+
+class _SpinWaitDetector:
+    """The guts of ThreadpoolController.detect_spin_wait
+
+    Refer to the docstring of ThreadpoolController.detect_spin_wait for more details.
+    """
+
+    def __init__(self, controller, *, duration, interval, threshold):
+        if not os.path.isdir("/proc/self/task"):
+            raise OSError(
+                "Detecting spin-waiting threads requires /proc/self/task, which is "
+                "only available on Linux."
+            )
+        self._controller = controller
+        self._duration = duration
+        self._interval = interval
+        self._threshold = threshold
+        self._cpu_times_at_enter = None
+        self.report = None
+
+    def __enter__(self):
+        self._cpu_times_at_enter = _read_threads_cpu_times()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is not None:
+            return
+
+        # Sample the CPU time of the threads while the calling thread is idle
+        start = time.perf_counter()
+        samples = [(0.0, _read_threads_cpu_times())]
+        while samples[-1][0] < self._duration:
+            time.sleep(self._interval)
+            samples.append((time.perf_counter() - start, _read_threads_cpu_times()))
+
+        # The Python threads are not worker threads of the thread pools
+        python_tids = {thread.native_id for thread in threading.enumerate()}
+
+        spinning_threads = []
+        for tid, cpu_time_at_exit in samples[0][1].items():
+            if tid in python_tids:
+                continue
+            # Only the threads that worked during the block can be its workers. The
+            # threads started during the block are not in the sample at enter.
+            if cpu_time_at_exit <= self._cpu_times_at_enter.get(tid, 0.0):
+                continue
+            # The thread spins as long as it keeps burning CPU after the block
+            spin_duration = 0.0
+            for (t0, cpu_times0), (t1, cpu_times1) in zip(samples, samples[1:]):
+                if tid not in cpu_times1:
+                    break
+                if cpu_times1[tid] - cpu_times0[tid] < self._threshold * (t1 - t0):
+                    break
+                spin_duration = t1
+            if spin_duration > 0:
+                # Last CPU time of the thread, which may have exited since
+                cpu_time = max(
+                    cpu_times[tid] for _, cpu_times in samples if tid in cpu_times
+                )
+                spinning_threads.append(
+                    {
+                        "tid": tid,
+                        "cpu_seconds": cpu_time - cpu_time_at_exit,
+                        "spin_duration": spin_duration,
+                    }
+                )
+
+        runtimes = []
+        for lib_controller in self._controller.lib_controllers:
+            controls = _get_spin_wait_controls(lib_controller)
+            num_threads = lib_controller.num_threads
+            # The libraries whose number of threads is unknown are kept
+            if controls is None or (num_threads is not None and num_threads <= 1):
+                continue
+            runtime, suggested_environment = controls
+            runtimes.append(
+                {
+                    **_get_lib_info(
+                        lib_controller,
+                        ["internal_api", "prefix", "filepath", "num_threads"],
+                    ),
+                    "runtime": runtime,
+                    "environment": {
+                        var: os.environ.get(var) for var in suggested_environment
+                    },
+                    "suggested_environment": suggested_environment,
+                }
+            )
+
+        self.report = {
+            "duration": samples[-1][0],
+            "spinning": bool(spinning_threads),
+            "spinning_threads": spinning_threads,
+            "cpu_seconds": sum(thread["cpu_seconds"] for thread in spinning_threads),
+            "runtimes": runtimes if spinning_threads else [],
+        }
 
 
 class ThreadpoolController:
@@ -813,20 +1998,120 @@ class ThreadpoolController:
     # during the lifetime of a program.
     _system_libraries = dict()
 
+    # Cache of the library controllers, shared by all the instances, for the same
+    # reasons. Instantiating a library controller has a cost (loading a handle to the
+    # library, finding the symbol affixes, retrieving the version, ...).
+    _lib_controllers_cache = dict()
+
+    # Process-wide instance used by threadpool_info and threadpool_limits. It is only
+    # rescanned when shared libraries have been loaded or unloaded since the last
+    # scan, see `_refresh`.
+    _shared_instance = None
+    _shared_instance_lock = threading.Lock()
+
+    # Backend selected by measuring their cost when THREADPOOLCTL_DISCOVERY_BACKEND is
+    # "auto", see `_get_discovery_backend`. Measured once per process.
+    _measured_discovery_backend = None
+
     def __init__(self):
         self.lib_controllers = []
+        self._seen_filepaths = set()
+        self._generation = None
+        self._events = []
         self._load_libraries()
         self._warn_if_incompatible_openmp()
+        self._send_discovery_events()
 
     @classmethod
     def _from_controllers(cls, lib_controllers):
         new_controller = cls.__new__(cls)
         new_controller.lib_controllers = lib_controllers
+        new_controller._seen_filepaths = set()
+        new_controller._generation = None
+        new_controller._events = []
         return new_controller
 
-    def info(self):
-        """Return lib_controllers info as a list of dicts"""
-        return [lib_controller.info() for lib_controller in self.lib_controllers]
+    @classmethod
+    def _get_shared_instance(cls):
+        """Return a controller holding the lib controllers of the shared instance
+
+        The shared instance is refreshed first. A new controller holding a copy of the
+        list of lib controllers is returned such that a rescan triggered later does
+        not affect the caller.
+        """
+        with cls._shared_instance_lock:
+            if cls._shared_instance is None:
+                cls._shared_instance = cls._from_controllers([])
+            cls._shared_instance._refresh()
+            lib_controllers = list(cls._shared_instance.lib_controllers)
+            events, cls._shared_instance._events = cls._shared_instance._events, []
+        _send_events(events)
+        return cls._from_controllers(lib_controllers)
+
+    def _send_discovery_events(self):
+        """Send the "discovery" events of the libraries found by this controller"""
+        events, self._events = self._events, []
+        _send_events(events)
+
+    def _refresh(self):
+        """Rescan the loaded libraries if they changed since the last scan
+
+        The generation counters of the dynamic loader tell whether libraries were
+        loaded or unloaded. If only new libraries were loaded, only the paths that
+        were not seen before are inspected. If some libraries were unloaded or if
+        the counters are not available, a full scan is performed.
+        """
+        generation = self._get_loaded_libraries_generation()
+        if generation is not None and generation == self._generation:
+            return
+
+        if (
+            generation is None
+            or self._generation is None
+            or generation[1] != self._generation[1]
+        ):
+            self.lib_controllers = []
+            self._seen_filepaths = set()
+
+        self._generation = generation
+        n_lib_controllers = len(self.lib_controllers)
+        self._load_libraries()
+        if len(self.lib_controllers) > n_lib_controllers:
+            self._warn_if_incompatible_openmp()
+
+    def _get_loaded_libraries_generation(self):
+        """Return the (dlpi_adds, dlpi_subs) counters of the dynamic loader
+
+        Return None if these counters are not available on this platform.
+        """
+        if sys.platform in ("darwin", "win32") or "pyodide" in sys.modules:
+            return None
+
+        libc = self._get_libc()
+        if not hasattr(libc, "dl_iterate_phdr"):  # pragma: no cover
+            return None
+
+        generation = []
+
+        def generation_callback(info, size, data):
+            if size >= _DL_PHDR_INFO_COUNTERS_SIZE:
+                generation.append((info.contents.dlpi_adds, info.contents.dlpi_subs))
+            # The counters are the same for all the objects, stop at the first one.
+            return 1
+
+        libc.dl_iterate_phdr(_dl_iterate_phdr_callback_t(generation_callback), None)
+        return generation[0] if generation else None
+
+    def info(self, fields=None):
+        """Return lib_controllers info as a list of dicts
+
+        If `fields` is a list of entries of the info dicts, only these entries are
+        computed and returned. See `threadpool_info` for more details.
+        """
+        return [
+            _get_lib_info(lib_controller, fields)
+            for lib_controller in self.lib_controllers
+        ]
 
     def select(self, **kwargs):
         """Return a ThreadpoolController containing a subset of its current
@@ -855,6 +2140,169 @@ class ThreadpoolController:
 
         return ThreadpoolController._from_controllers(lib_controllers)
 
+    def oversubscription_report(self, *, warn=False, callback=None):
+        """Estimate the worst-case number of threads running concurrently.
+
+        The number of threads of each library is reported in isolation by `info`. This
+        function combines them with their threading layer, the number of live Python
+        threads and the number of usable CPUs:
+
+          - each live Python thread can be running.
+          - the OpenMP libraries and the libraries relying on an OpenMP threading
+            layer have a per-thread setting: each Python thread can lead its own team
+            of threads, up to their largest number of threads.
+          - the other libraries, e.g. OpenBLAS with the pthreads threading layer, have
+            a process-wide thread pool. Each of them adds its worker threads on top of
+            the calling thread, once per library, e.g. twice when numpy and scipy
+            vendor distinct copies of OpenBLAS.
+          - the libraries with a sequential threading layer only use the calling
+            thread.
+          - the libraries whose number of threads is unknown are not taken into
+            account.
+
+        Return a dict with the following entries:
+
+          - "cpu_count": the number of CPUs the process can use, as returned by
+            `available_cpus`.
+          - "python_threads": the number of live Python threads.
+          - "libraries": for each library, its "user_api", "internal_api", "prefix",
+            "filepath", "num_threads", "threading_layer" (None if not applicable) and
+            "pool" ("per-thread", "process", "sequential" or "unknown").
+          - "max_concurrency": the worst-case number of threads running concurrently.
+          - "oversubscribed": whether "max_concurrency" exceeds "cpu_count".
+          - "suggested_limits": a dict `{user_api: num_threads}` that can be passed to
+            `limit` to bring "max_concurrency" back under "cpu_count", when possible.
+            Empty if not oversubscribed.
+
+        Parameters
+        ----------
+        warn : bool (default=False)
+            Whether to raise a RuntimeWarning when oversubscribed.
+
+        callback : callable or None (default=None)
+            Function called with the report when oversubscribed, e.g. to set the
+            suggested limits: `lambda report:
+            controller.limit(limits=report["suggested_limits"])`.
+        """
+        cpu_count = available_cpus()
+        python_threads = threading.active_count()
+
+        libraries = []
+        for lib_controller in self.lib_controllers:
+            lib_info = _get_lib_info(
+                lib_controller,
+                ["user_api", "internal_api", "prefix", "filepath", "num_threads"],
+            )
+            threading_layer = getattr(lib_controller, "threading_layer", None)
+            if lib_info["num_threads"] is None:
+                pool = "unknown"
+            elif threading_layer in _SEQUENTIAL_THREADING_LAYERS:
+                pool = "sequential"
+            elif (
+                lib_controller._per_thread_num_threads
+                or threading_layer in _OPENMP_THREADING_LAYERS
+            ):
+                pool = "per-thread"
+            else:
+                pool = "process"
+            libraries.append(
+                {**lib_info, "threading_layer": threading_layer, "pool": pool}
+            )
+
+        per_thread = [lib for lib in libraries if lib["pool"] == "per-thread"]
+        process_wide = [lib for lib in libraries if lib["pool"] == "process"]
+        max_concurrency = python_threads * max(
+            [lib["num_threads"] for lib in per_thread], default=1
+        ) + sum(lib["num_threads"] - 1 for lib in process_wide)
+        oversubscribed = max_concurrency > cpu_count
+
+        suggested_limits = {}
+        if oversubscribed:
+            # Share the CPUs between the teams that the Python threads can lead and
+            # the worker threads of the process-wide thread pools, such that
+            # n_python_threads * n + n_process_wide * (n - 1) <= cpu_count.
+            num_threads = max(
+                1,
+                (cpu_count + len(process_wide)) // (python_threads + len(process_wide)),
+            )
+            for lib in per_thread + process_wide:
+                if lib["num_threads"] > num_threads:
+                    suggested_limits[lib["user_api"]] = num_threads
+
+        report = {
+            "cpu_count": cpu_count,
+            "python_threads": python_threads,
+            "libraries": libraries,
+            "max_concurrency": max_concurrency,
+            "oversubscribed": oversubscribed,
+            "suggested_limits": suggested_limits,
+        }
+
+        if oversubscribed:
+            if warn:
+                warnings.warn(
+                    f"Up to {max_concurrency} threads can run concurrently on "
+                    f"{cpu_count} CPUs. Consider setting the following limits: "
+                    f"{suggested_limits}.",
+                    RuntimeWarning,
+                )
+            if callback is not None:
+                callback(report)
+
+        return report
+
+    def detect_spin_wait(self, *, duration=0.5, interval=0.05, threshold=0.5):
+        """Detect worker threads that keep burning CPU after a block of code.
+
+        After a parallel region, the worker threads of some runtimes busy-wait for a
+        while before going to sleep, to be ready for the next parallel region. This
+        burns CPUs that other work may need. This context manager samples the CPU
+        time of each thread from /proc/self/task when the block is entered, and when
+        it exits for `duration` seconds while the calling thread is idle. The threads
+        other than the Python threads that used CPU during the block and keep using
+        more than `threshold` CPU after it are reported as spinning.
+
+        The report is available as the `report` attribute of the context manager
+        after the block, unless the block raised an exception. It is a dict with the
+        following entries:
+
+          - "duration": the time during which the threads were sampled.
+          - "spinning": whether spinning threads were detected.
+          - "spinning_threads": for each spinning thread, its native "tid", the
+            "cpu_seconds" it burned during the sampling and its "spin_duration", i.e.
+            for how long it kept spinning after the block.
+          - "cpu_seconds": the total CPU time burned by the spinning threads.
+          - "runtimes": if spinning threads were detected, the libraries using more
+            than one thread, or an unknown number of threads, whose runtime can
+            spin-wait, i.e. the possible culprits.
+            Each has its "internal_api", "prefix", "filepath", "num_threads", its
+            "runtime" ("gnu", "intel" or "llvm" OpenMP or "openblas"), the current
+            values of the environment variables that control the spinning in
+            "environment" and the values that would reduce it in
+            "suggested_environment". These variables are read when the runtime is
+            initialized and must be set before starting the process. Limiting the
+            number of threads, see `limit`, also reduces the number of spinning
+            threads.
+
+        Only available on Linux. The resolution of the CPU times is a clock tick,
+        usually 10ms, such that `interval` should not be much lower.
+
+        Parameters
+        ----------
+        duration : float (default=0.5)
+            The time in seconds during which the threads are sampled after the block.
+
+        interval : float (default=0.05)
+            The time in seconds between two samples.
+
+        threshold : float (default=0.5)
+            The fraction of a CPU above which a thread is considered spinning during
+            an interval.
+        """
+        return _SpinWaitDetector(
+            self, duration=duration, interval=interval, threshold=threshold
+        )
+
     def _get_params_for_sequential_blas_under_openmp(self):
         """Return appropriate params to use for a sequential BLAS call in an OpenMP loop
 
@@ -872,25 +2320,31 @@ class ThreadpoolController:
         BLAS_LIBS=", ".join(_ALL_BLAS_LIBRARIES),
         OPENMP_LIBS=", ".join(_ALL_OPENMP_LIBRARIES),
     )
-    def limit(self, *, limits=None, user_api=None):
+    def limit(self, *, limits=None, user_api=None, scope="process"):
         """Change the maximal number of threads that can be used in thread pools.
 
         This function returns an object that can be used either as a callable (the
         construction of this object limits the number of threads) or as a context
-        manager, in a `with` block to automatically restore the original state of the
-        controlled libraries when exiting the block.
+        manager, in a `with` or `async with` block to automatically restore the
+        original state of the controlled libraries when exiting the block.
+
+        The limits of an `async with` block are set when entering it and restored when
+        exiting it: they also apply to the other tasks run by the event loop thread
+        while the block is suspended at an `await`. Use `wrap` to decorate a coroutine
+        function instead to limit only the task running it.
 
         Set the maximal number of threads that can be used in thread pools used in
         the supported libraries to `limits`. This function works for libraries that
         are already loaded in the interpreter and can be changed dynamically.
 
-        This effect is global and impacts the whole Python process. There is no thread
-        level isolation as these libraries do not offer thread-local APIs to configure
-        the number of threads to use in nested parallel calls.
+        By default, this effect is global and impacts the whole Python process. Most of
+        these libraries do not offer thread-local APIs to configure the number of
+        threads to use in nested parallel calls. OpenMP is an exception:
+        `scope="thread"` limits the OpenMP libraries for the calling thread only.
 
         Parameters
         ----------
-        limits : int, dict, 'sequential_blas_under_openmp' or None (default=None)
+        limits : int, dict, str or None (default=None)
             The maximal number of threads that can be used in thread pools
 
             - If int, sets the maximum number of threads to `limits` for each
@@ -905,6 +2359,11 @@ class ThreadpoolController:
               calls within an OpenMP parallel region. The `user_api` parameter is
               ignored.
 
+            - If 'auto', sets the maximum number of threads to the number of CPUs the
+              process can use, as returned by `available_cpus`, for each library
+              selected by `user_api`. It accounts for the CPU quota of containers and
+              for the CPUs allocated by batch schedulers.
+
             - If None, this function does not do anything.
 
         user_api : {USER_APIS} or None (default=None)
@@ -917,19 +2376,35 @@ class ThreadpoolController:
               by the BLAS libraries if they rely on OpenMP.
 
             - If None, this function will apply to all supported libraries.
+
+        scope : "process" or "thread" (default="process")
+            The extent of the limits.
+
+            - If "process", the limits apply to the whole Python process.
+
+            - If "thread", only the OpenMP libraries ({OPENMP_LIBS}) are limited,
+              and only for the calling thread, since their number of threads is a
+              per-thread setting. The other libraries and the other threads are left
+              untouched.
         """
-        return _ThreadpoolLimiter(self, limits=limits, user_api=user_api)
+        return _ThreadpoolLimiter(self, limits=limits, user_api=user_api, scope=scope)
 
     @_format_docstring(
         USER_APIS=", ".join('"{}"'.format(api) for api in _ALL_USER_APIS),
         BLAS_LIBS=", ".join(_ALL_BLAS_LIBRARIES),
         OPENMP_LIBS=", ".join(_ALL_OPENMP_LIBRARIES),
     )
-    def wrap(self, *, limits=None, user_api=None):
+    def wrap(self, *, limits=None, user_api=None, scope="process"):
         """Change the maximal number of threads that can be used in thread pools.
 
         This function returns an object that can be used as a decorator.
 
+        When decorating a coroutine function, an async generator function or a
+        generator function, the limits are set each time the body of the coroutine or
+        generator is resumed and restored each time it is suspended at an `await` or a
+        `yield`, such that interleaved coroutines or generators each run with their own
+        limits.
+
         Set the maximal number of threads that can be used in thread pools used in
         the supported libraries to `limits`. This function works for libraries that
         are already loaded in the interpreter and can be changed dynamically.
@@ -958,8 +2433,101 @@ class ThreadpoolController:
               by the BLAS libraries if they rely on OpenMP.
 
             - If None, this function will apply to all supported libraries.
+
+        scope : "process" or "thread" (default="process")
+            The extent of the limits. If "thread", only the OpenMP libraries
+            ({OPENMP_LIBS}) are limited, and only for the thread calling the
+            decorated function. See `limit` for details.
+        """
+        return _ThreadpoolLimiter.wrap(
+            self, limits=limits, user_api=user_api, scope=scope
+        )
+
+    @_format_docstring(
+        USER_APIS=", ".join('"{}"'.format(api) for api in _ALL_USER_APIS),
+    )
+    def wrap_by_size(self, size, thresholds, *, user_api=None, scope="process"):
+        """Decorator choosing the limits of each call from the size of its problem.
+
+        For small problems, the overhead of starting and synchronizing threads can
+        outweigh the benefit of running in parallel. `size` is called with the
+        arguments of each call of the decorated function and the limits associated
+        with the largest threshold smaller than or equal to the returned size are set
+        for the call, e.g. to run BLAS sequentially on small matrices only:
+
+            @controller.wrap_by_size(
+                size=lambda a, b: a.shape[0] * a.shape[1],
+                thresholds={{0: 1, 128**2: 4, 1024**2: None}},
+                user_api="blas",
+            )
+            def product(a, b):
+                return a @ b
+
+        No limits are set for sizes smaller than the smallest threshold or
+        associated with None. The function is decorated with `wrap` once per
+        threshold such that the limits are resolved when decorating, and each call
+        only has to compute the size and enter the pre-resolved limits.
+
+        Parameters
+        ----------
+        size : callable
+            Function called with the arguments of each call and returning its size.
+
+        thresholds : dict
+            A dict `{{min_size: limits}}` where `limits` is any value accepted by
+            `limit`.
+
+        user_api : {USER_APIS} or None (default=None)
+            APIs of libraries to limit, see `limit`.
+
+        scope : "process" or "thread" (default="process")
+            The extent of the limits, see `limit`.
         """
-        return _ThreadpoolLimiter.wrap(self, limits=limits, user_api=user_api)
+        min_sizes = sorted(thresholds)
+
+        def decorator(func):
+            # funcs[i] is the function to call for the sizes in
+            # [min_sizes[i - 1], min_sizes[i])
+            funcs = [func]
+            for min_size in min_sizes:
+                limits = thresholds[min_size]
+                if limits is not None:
+                    limiter = self.wrap(limits=limits, user_api=user_api, scope=scope)
+                    funcs.append(limiter(func))
+                else:
+                    funcs.append(func)
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                i = bisect.bisect_right(min_sizes, size(*args, **kwargs))
+                return funcs[i](*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def compile_limits(self, *, limits=None, user_api=None, scope="process"):
+        """Resolve limits once to enter them many times with a low overhead.
+
+        `limit` has to validate its parameters and match them against the library
+        controllers each time it is called. This function does it once and returns an
+        immutable plan holding the resulting `(lib_controller, num_threads)` pairs in
+        its `limits` attribute. The plan can then be used as a context manager any
+        number of times, including in nested `with` blocks or concurrently from
+        several threads, e.g. in a hot loop:
+
+            plan = controller.compile_limits(limits=1, user_api="blas")
+            for chunk in chunks:
+                with plan:
+                    process(chunk)
+
+        The parameters are the same as for the `limit` method. Note that the plan only
+        acts on the library controllers held by this controller at the time it is
+        compiled.
+        """
+        return _ThreadpoolLimiter.wrap(
+            self, limits=limits, user_api=user_api, scope=scope
+        )._plan
 
     def __len__(self):
         return len(self.lib_controllers)
@@ -972,9 +2540,68 @@ class ThreadpoolController:
             self._find_libraries_with_enum_process_module_ex()
         elif "pyodide" in sys.modules:
             self._find_libraries_pyodide()
+        elif self._get_discovery_backend() == "proc_maps":
+            self._find_libraries_with_proc_maps()
         else:
             self._find_libraries_with_dl_iterate_phdr()
 
+    @classmethod
+    def _get_discovery_backend(cls):
+        """Return the backend to use to find the loaded libraries on Linux
+
+        It can be selected explicitly with the THREADPOOLCTL_DISCOVERY_BACKEND
+        environment variable: either "dl_iterate_phdr" (the default), "proc_maps" or
+        "auto". In "auto" mode, the cost of listing the loaded libraries is measured
+        once for each backend and the cheapest one is used for the rest of the life of
+        the process.
+        """
+        backend = os.environ.get("THREADPOOLCTL_DISCOVERY_BACKEND", "dl_iterate_phdr")
+        if backend not in ("auto", *_DISCOVERY_BACKENDS):
+            raise ValueError(
+                "THREADPOOLCTL_DISCOVERY_BACKEND must be either in "
+                f"{['auto', *_DISCOVERY_BACKENDS]}. Got {backend!r} instead."
+            )
+        if backend != "auto":
+            return backend
+
+        if cls._measured_discovery_backend is None:
+            cls._measured_discovery_backend = cls._measure_discovery_backends()
+        return cls._measured_discovery_backend
+
+    @classmethod
+    def _measure_discovery_backends(cls, n_repeats=3):
+        """Return the name of the backend which lists the loaded libraries faster"""
+        timings = {}
+        for backend, get_filepaths in (
+            ("dl_iterate_phdr", cls._get_filepaths_with_dl_iterate_phdr),
+            ("proc_maps", cls._get_filepaths_with_proc_maps),
+        ):
+            best = float("inf")
+            for _ in range(n_repeats):
+                t = time.perf_counter()
+                try:
+                    filepaths = get_filepaths()
+                except OSError:
+                    filepaths = None
+                if filepaths is None:
+                    # This backend is not available
+                    break
+                best = min(best, time.perf_counter() - t)
+            timings[backend] = best
+        return min(timings, key=timings.get)
+
+    def _make_controllers_from_paths(self, filepaths):
+        """Store the library controllers of the supported libraries among filepaths"""
+        for filepath in filepaths:
+            # Libraries inspected by a previous scan are skipped. It only happens
+            # when refreshing the shared instance after new libraries were loaded.
+            if filepath in self._seen_filepaths:
+                continue
+            self._seen_filepaths.add(filepath)
+
+            # Store the library controller if it is supported and selected
+            self._make_controller_from_path(filepath)
+
     def _find_libraries_with_dl_iterate_phdr(self):
         """Loop through loaded libraries and return binders on supported ones
 
@@ -985,36 +2612,74 @@ class ThreadpoolController:
         Copyright (c) 2017, Intel Corporation published under the BSD 3-Clause
         license
         """
-        libc = self._get_libc()
-        if not hasattr(libc, "dl_iterate_phdr"):  # pragma: no cover
+        filepaths = self._get_filepaths_with_dl_iterate_phdr()
+        if filepaths is None:  # pragma: no cover
             warnings.warn(
                 "Could not find dl_iterate_phdr in the C standard library.",
                 RuntimeWarning,
             )
             return []
 
+        self._make_controllers_from_paths(filepaths)
+
+    @classmethod
+    def _get_filepaths_with_dl_iterate_phdr(cls):
+        """Return the paths of the loaded libraries reported by dl_iterate_phdr
+
+        Return None if dl_iterate_phdr is not available.
+        """
+        libc = cls._get_libc()
+        if not hasattr(libc, "dl_iterate_phdr"):  # pragma: no cover
+            return None
+
+        filepaths = []
+
         # Callback function for `dl_iterate_phdr` which is called for every
         # library loaded in the current process until it returns 1.
         def match_library_callback(info, size, data):
             # Get the path of the current library
             filepath = info.contents.dlpi_name
             if filepath:
-                filepath = filepath.decode("utf-8")
-
-                # Store the library controller if it is supported and selected
-                self._make_controller_from_path(filepath)
+                filepaths.append(filepath.decode("utf-8"))
             return 0
 
-        c_func_signature = ctypes.CFUNCTYPE(
-            ctypes.c_int,  # Return type
-            ctypes.POINTER(_dl_phdr_info),
-            ctypes.c_size_t,
-            ctypes.c_char_p,
-        )
-        c_match_library_callback = c_func_signature(match_library_callback)
+        c_match_library_callback = _dl_iterate_phdr_callback_t(match_library_callback)
 
         data = ctypes.c_char_p(b"")
         libc.dl_iterate_phdr(c_match_library_callback, data)
+        return filepaths
+
+    def _find_libraries_with_proc_maps(self):
+        """Loop through loaded libraries and return binders on supported ones
+
+        This function is expected to work on Linux only. It parses the memory
+        mappings of the process instead of calling back into Python for each loaded
+        library.
+        """
+        try:
+            filepaths = self._get_filepaths_with_proc_maps()
+        except OSError:  # pragma: no cover
+            # /proc is not mounted, e.g. in some sandboxed environments.
+            self._find_libraries_with_dl_iterate_phdr()
+            return
+
+        self._make_controllers_from_paths(filepaths)
+
+    @staticmethod
+    def _get_filepaths_with_proc_maps():
+        """Return the paths of the files mapped as executable in the process
+
+        The whole /proc/self/maps file is read at once and the paths are deduplicated
+        since each library is made of several mappings.
+        """
+        with open("/proc/self/maps", "rb") as f:
+            maps = f.read()
+
+        filepaths = dict.fromkeys(_PROC_MAPS_EXECUTABLE_FILE_RE.findall(maps))
+        return [
+            filepath.decode("utf-8").removesuffix(" (deleted)")
+            for filepath in filepaths
+        ]
 
     def _find_libraries_with_dyld(self):
         """Loop through loaded libraries and return binders on supported ones
@@ -1149,21 +2814,17 @@ class ThreadpoolController:
         """Store a library controller if it is supported and selected"""
         # Required to resolve symlinks
         filepath = _realpath(filepath)
+
+        if filepath in (lib.filepath for lib in self.lib_controllers):
+            # We already have a controller for this library.
+            return
+
         # `lower` required to take account of OpenMP dll case on Windows
         # (vcomp, VCOMP, Vcomp, ...)
         filename = os.path.basename(filepath).lower()
 
-        # Loop through supported libraries to find if this filename corresponds
-        # to a supported one.
-        for controller_class in _ALL_CONTROLLERS:
-            # check if filename matches a supported prefix
-            prefix = self._check_prefix(filename, controller_class.filename_prefixes)
-
-            # filename does not match any of the prefixes of the candidate
-            # library. move to next library.
-            if prefix is None:
-                continue
-
+        # Loop through the supported libraries whose prefixes the filename matches.
+        for controller_class, prefix in _get_prefix_index().match(filename):
             # workaround for BLAS libraries packaged by conda-forge on windows, which
             # are all renamed "libblas.dll". We thus have to check to which BLAS
             # implementation it actually corresponds looking for implementation
@@ -1184,34 +2845,66 @@ class ThreadpoolController:
                     # duplicate entry in threadpool_info.
                     continue
 
-            # filename matches a prefix. Now we check if the library has the symbols we
-            # are looking for. If none of the symbols exists, it's very likely not the
-            # expected library (e.g. a library having a common prefix with one of the
-            # our supported libraries). Otherwise, create and store the library
-            # controller.
-            lib_controller = controller_class(
-                filepath=filepath, prefix=prefix, parent=self
+            lib_controller = self._get_lib_controller(
+                controller_class, filepath, prefix
             )
-
-            if filepath in (lib.filepath for lib in self.lib_controllers):
-                # We already have a controller for this library.
-                continue
-
-            if not hasattr(controller_class, "check_symbols") or any(
-                hasattr(lib_controller.dynlib, func)
-                for func in controller_class.check_symbols
-            ):
+            if lib_controller is not None:
                 self.lib_controllers.append(lib_controller)
+                return
 
-    def _check_prefix(self, library_basename, filename_prefixes):
-        """Return the prefix library_basename starts with
+    def _get_lib_controller(self, controller_class, filepath, prefix):
+        """Return a controller of type controller_class for the library at filepath
 
-        Return None if none matches.
+        Return None if the library does not expose the expected symbols. The
+        controllers are cached and reused by all the ThreadpoolController instances.
+        The file is identified by its device and inode numbers in addition to its path
+        to not reuse a controller for a different file at the same path.
         """
-        for prefix in filename_prefixes:
-            if library_basename.startswith(prefix):
-                return prefix
-        return None
+        try:
+            stat_result = os.stat(filepath)
+        except OSError:  # pragma: no cover
+            # The file was removed after being loaded. Don't cache its controller.
+            key = None
+        else:
+            key = (filepath, stat_result.st_dev, stat_result.st_ino, controller_class)
+
+        if key in self._lib_controllers_cache:
+            lib_controller = self._lib_controllers_cache[key]
+            if lib_controller is not None:
+                # FlexiBLAS controllers need to trigger a new search of the loaded
+                # libraries in all the controllers holding them when switching backend.
+                lib_controller._parents.add(self)
+            return lib_controller
+
+        # filename matches a prefix. Now we check if the library has the symbols we
+        # are looking for. If none of the symbols exists, it's very likely not the
+        # expected library (e.g. a library having a common prefix with one of the
+        # our supported libraries). Otherwise, create the library controller.
+        dynlib = ctypes.CDLL(filepath, mode=_RTLD_NOLOAD)
+        if not hasattr(controller_class, "check_symbols") or any(
+            hasattr(dynlib, func) for func in controller_class.check_symbols
+        ):
+            lib_controller = controller_class(
+                filepath=filepath, prefix=prefix, parent=self
+            )
+            # Sent once the shared instance lock is released, see _send_events
+            self._events.append(
+                (
+                    "discovery",
+                    (
+                        filepath,
+                        prefix,
+                        lib_controller.user_api,
+                        lib_controller.internal_api,
+                    ),
+                )
+            )
+        else:
+            lib_controller = None
+
+        if key is not None:
+            self._lib_controllers_cache[key] = lib_controller
+        return lib_controller
 
     def _warn_if_incompatible_openmp(self):
         """Raise a warning if llvm-OpenMP and intel-OpenMP are both loaded"""
@@ -1234,6 +2927,8 @@ class ThreadpoolController:
     def _get_libc(cls):
         """Load the lib-C for unix systems."""
         libc = cls._system_libraries.get("libc")
+        if libc is None:
+            libc = cls._find_loaded_libc()
         if libc is None:
             # Remark: If libc is statically linked or if Python is linked against an
             # alternative implementation of libc like musl, find_library will return
@@ -1242,9 +2937,44 @@ class ThreadpoolController:
             # If the main program does not contain the libc symbols, it's ok because
             # we check their presence later anyway.
             libc = ctypes.CDLL(find_library("c"), mode=_RTLD_NOLOAD)
-            cls._system_libraries["libc"] = libc
+        cls._system_libraries["libc"] = libc
         return libc
 
+    @classmethod
+    def _find_loaded_libc(cls):
+        """Return a handle to the libc already loaded in the process
+
+        `find_library` can spawn subprocesses (ldconfig, gcc, ...) on Linux which is
+        slow and can fail in minimal containers. Instead, the libc symbols are first
+        looked up from the main program, whose handle gives access to the symbols of
+        all its dependencies. Then the path of the running libc is searched in the
+        memory mappings of the process. Return None if none of these works.
+        """
+        symbol = "_dyld_image_count" if sys.platform == "darwin" else "dl_iterate_phdr"
+
+        try:
+            libc = ctypes.CDLL(None)
+        except OSError:  # pragma: no cover
+            pass
+        else:
+            if hasattr(libc, symbol):
+                return libc
+
+        try:
+            filepaths = cls._get_filepaths_with_proc_maps()
+        except OSError:
+            return None
+
+        for filepath in filepaths:
+            if _LIBC_FILENAME_RE.match(os.path.basename(filepath)):
+                try:
+                    libc = ctypes.CDLL(filepath, mode=_RTLD_NOLOAD)
+                except OSError:  # pragma: no cover
+                    continue
+                if hasattr(libc, symbol):
+                    return libc
+        return None
+
     @classmethod
     def _get_windll(cls, dll_name):
         """Load a windows DLL"""
@@ -1255,6 +2985,785 @@ class ThreadpoolController:
         return dll
 
 
+# Environment variables read by the supported libraries when they are loaded, to set
+# the number of threads of libraries that are only loaded after a worker started.
+_NUM_THREADS_ENV_VARS = {
+    "blas": ("OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS"),
+    "openmp": ("OMP_NUM_THREADS",),
+}
+
+
+# Environment variables set by batch schedulers to the number of CPUs allocated to a
+# job: SLURM, Sun/Univa Grid Engine and IBM LSF.
+_SCHEDULER_CPUS_ENV_VARS = ("SLURM_CPUS_PER_TASK", "NSLOTS", "LSB_DJOB_NUMPROC")
+
+
+@_format_docstring(
+    SCHEDULER_ENV_VARS=", ".join(f"`{env_var}`" for env_var in _SCHEDULER_CPUS_ENV_VARS)
+)
+def available_cpus(*, root="/"):
+    """Return the number of CPUs the current process can use.
+
+    The native libraries usually size their thread pools from the number of CPUs of
+    the host, which oversubscribes the CPUs when the process is restricted to fewer
+    of them. This function takes the minimum of:
+
+      - the number of CPUs the process can run on, from `os.process_cpu_count`
+        (Python >= 3.13), `os.sched_getaffinity` or `os.cpu_count`.
+      - the CPU quota of the cgroups of the process (`cpu.max` for cgroup v2,
+        `cpu.cfs_quota_us` / `cpu.cfs_period_us` for cgroup v1), rounded up, as set
+        by docker or Kubernetes for instance.
+      - the number of CPUs allocated by a batch scheduler through the
+        {SCHEDULER_ENV_VARS} environment variables.
+
+    Parameters
+    ----------
+    root : str (default="/")
+        The root directory under which the `proc/self/cgroup` file and the
+        `sys/fs/cgroup` directory are looked up.
+    """
+    if hasattr(os, "process_cpu_count"):
+        cpu_counts = [os.process_cpu_count()]
+    elif hasattr(os, "sched_getaffinity"):
+        cpu_counts = [len(os.sched_getaffinity(0))]
+    else:
+        cpu_counts = [os.cpu_count()]
+
+    cpu_counts.append(_get_cgroup_cpu_quota(root))
+
+    for env_var in _SCHEDULER_CPUS_ENV_VARS:
+        try:
+            cpu_counts.append(int(os.environ[env_var]))
+        except (KeyError, ValueError):
+            pass
+
+    return max(1, min((n for n in cpu_counts if n), default=1))
+
+
+def _get_cgroup_cpu_quota(root):
+    """Number of CPUs allowed by the cgroups of the current process, or None"""
+    try:
+        with open(os.path.join(root, "proc", "self", "cgroup")) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+
+    cgroup_root = os.path.join(root, "sys", "fs", "cgroup")
+    quotas = []
+    for line in lines:
+        hierarchy_id, controllers, path = line.split(":", 2)
+        if hierarchy_id == "0" and controllers == "":
+            mount_points = [cgroup_root]
+            read_quota = _read_cgroup_v2_cpu_quota
+        elif "cpu" in controllers.split(","):
+            mount_points = [os.path.join(cgroup_root, controllers)]
+            mount_points.append(os.path.join(cgroup_root, "cpu"))
+            read_quota = _read_cgroup_v1_cpu_quota
+        else:
+            continue
+
+        # The quota of a cgroup is also bounded by the quotas of its ancestors. When
+        # the cgroup of the process is not visible, e.g. in a container without its
+        # own cgroup namespace, only the root of the mount point is checked.
+        parts = [part for part in path.split("/") if part]
+        for mount_point in mount_points:
+            if not os.path.isdir(mount_point):
+                continue
+            for i in range(len(parts), -1, -1):
+                quota = read_quota(os.path.join(mount_point, *parts[:i]))
+                if quota is not None:
+                    quotas.append(quota)
+            break
+
+    if not quotas:
+        return None
+    return max(1, math.ceil(min(quotas)))
+
+
+def _read_cgroup_v2_cpu_quota(cgroup_dir):
+    """CPU quota from the cpu.max file of a cgroup v2 directory, or None"""
+    try:
+        with open(os.path.join(cgroup_dir, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return int(quota) / int(period)
+
+
+def _read_cgroup_v1_cpu_quota(cgroup_dir):
+    """CPU quota from the cpu.cfs_* files of a cgroup v1 directory, or None"""
+    try:
+        with open(os.path.join(cgroup_dir, "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(cgroup_dir, "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return quota / period
+
+
+def worker_threadpool_limits(n_workers, user_api=None):
+    """Limit the thread pools of a worker process to its share of the CPUs.
+
+    Meant to be used as the initializer of the workers of a process pool, e.g.
+    `multiprocessing.Pool(n, initializer=worker_threadpool_limits, initargs=(n,))`,
+    to avoid the oversubscription caused by each worker sizing its thread pools to use
+    all the CPUs. The CPUs the worker can use, as returned by `available_cpus`, are
+    split evenly across `n_workers`, with at least 1 thread per worker. The limits are
+    set for the whole lifetime of the worker, for the libraries already loaded and,
+    through the corresponding environment variables, for the libraries loaded
+    afterwards.
+
+    Return the number of threads each library is limited to.
+
+    Parameters
+    ----------
+    n_workers : int or multiprocessing.Value
+        The number of workers of the pool. It is read when the worker starts, so a
+        shared `multiprocessing.Value` can be passed and updated when the pool is
+        resized, for the workers started afterwards to use the new budget.
+
+    user_api : "blas", "openmp" or None (default=None)
+        APIs of libraries to limit. If None, both the BLAS and the OpenMP libraries
+        are limited.
+    """
+    n_workers = getattr(n_workers, "value", n_workers)
+    num_threads = max(1, available_cpus() // max(1, n_workers))
+
+    threadpool_limits(limits=num_threads, user_api=user_api)
+
+    user_apis = list(_NUM_THREADS_ENV_VARS) if user_api is None else [user_api]
+    _set_num_threads_env_vars({api: num_threads for api in user_apis})
+
+    return num_threads
+
+
+def _set_num_threads_env_vars(limits):
+    """Set the environment variables read by the libraries when they are loaded
+
+    `limits` is a dict `{user_api: num_threads}`. The user APIs without environment
+    variables are ignored.
+    """
+    for api, num_threads in limits.items():
+        for env_var in _NUM_THREADS_ENV_VARS.get(api, ()):
+            os.environ[env_var] = str(num_threads)
+
+
+def _initialize_worker(n_workers, user_api, initializer, initargs):
+    worker_threadpool_limits(n_workers, user_api=user_api)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def process_pool_executor(
+    max_workers=None, *, user_api=None, initializer=None, initargs=(), **kwargs
+):
+    """ProcessPoolExecutor whose workers split the CPUs between their thread pools.
+
+    Each worker is initialized with `worker_threadpool_limits` such that the thread
+    pools of the BLAS and OpenMP libraries of all the workers together use as many
+    threads as there are CPUs available, instead of each of them using all the CPUs.
+
+    Parameters
+    ----------
+    max_workers : int or None (default=None)
+        The number of workers. If None, it defaults to the number of CPUs the current
+        process can use, as returned by `available_cpus`.
+
+    user_api : "blas", "openmp" or None (default=None)
+        APIs of libraries to limit. If None, both the BLAS and the OpenMP libraries
+        are limited.
+
+    initializer, initargs :
+        An additional initializer to call in each worker, after the limits are set.
+
+    **kwargs :
+        Other parameters passed to `concurrent.futures.ProcessPoolExecutor`.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if max_workers is None:
+        max_workers = available_cpus()
+        if sys.platform == "win32":
+            # Maximum number of workers supported by ProcessPoolExecutor on Windows
+            max_workers = min(max_workers, 61)
+
+    return ProcessPoolExecutor(
+        max_workers,
+        initializer=_initialize_worker,
+        initargs=(max_workers, user_api, initializer, initargs),
+        **kwargs,
+    )
+
+
+def _get_default_tune_cache_file():
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache")
+    return os.path.join(os.path.expanduser(cache_dir), "threadpoolctl", "tune.json")
+
+
+def _load_tune_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _save_tune_cache(cache_file, cache):
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    # Write to a temporary file first such that concurrent processes never read a
+    # partially written cache.
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, cache_file)
+
+
+def tune(
+    func,
+    *,
+    candidates=None,
+    user_api="blas",
+    key=None,
+    n_warmup=1,
+    n_repeats=5,
+    cache_file=None,
+    retune=False,
+):
+    """Find the number of threads for which a workload runs the fastest.
+
+    `func` is called without arguments with the libraries selected by `user_api`
+    limited to each of the `candidates` in turn: `n_warmup` times to warm up the
+    thread pools and caches, then `n_repeats` times to measure its median duration.
+    The fastest candidate is returned, the smallest one in case of a tie.
+
+    The results are saved in an on-disk JSON cache, keyed by `key` and by the
+    internal_api, version, architecture and threading layer of each selected library.
+    Later calls with the same key in the same environment return the cached optimum
+    without running `func`. The result can be applied with `threadpool_limits`:
+
+        num_threads = tune(my_workload, key="gemm-1000")
+        with threadpool_limits(limits=num_threads, user_api="blas"):
+            ...
+
+    Return None if no library is selected by `user_api`.
+
+    Parameters
+    ----------
+    func : callable
+        The workload to time. It should be representative of the calls to tune the
+        number of threads for, e.g. with the same problem size.
+
+    candidates : list of int or None (default=None)
+        The numbers of threads to try. If None, the powers of 2 up to the number of
+        available CPUs, and that number itself (see `available_cpus`).
+
+    user_api : "blas", "openmp" or None (default="blas")
+        APIs of libraries to limit. If None, all the supported libraries.
+
+    key : str or None (default=None)
+        Identifies the workload in the cache, e.g. including the problem size. If
+        None, the qualified name of `func` is used.
+
+    n_warmup : int (default=1)
+        Number of untimed calls of `func` for each candidate.
+
+    n_repeats : int (default=5)
+        Number of timed calls of `func` for each candidate.
+
+    cache_file : str or None (default=None)
+        Path to the JSON cache file. If None, `threadpoolctl/tune.json` in the user
+        cache directory (`$XDG_CACHE_HOME` or `~/.cache`).
+
+    retune : bool (default=False)
+        Whether to time `func` again and overwrite the cached result.
+    """
+    controller = ThreadpoolController._get_shared_instance()
+    if user_api is not None:
+        controller = controller.select(user_api=user_api)
+    if not controller:
+        return None
+
+    if candidates is None:
+        n_cpus = available_cpus()
+        candidates = [2**i for i in range(n_cpus.bit_length()) if 2**i < n_cpus]
+        candidates.append(n_cpus)
+    if key is None:
+        key = f"{func.__module__}.{func.__qualname__}"
+    if cache_file is None:
+        cache_file = _get_default_tune_cache_file()
+
+    fields = ["internal_api", "version", "architecture", "threading_layer"]
+    libraries = [
+        [lib_info.get(field) for field in fields]
+        for lib_info in controller.info(fields=fields)
+    ]
+    cache_key = json.dumps([key, libraries])
+    cache = _load_tune_cache(cache_file)
+    if not retune and cache_key in cache:
+        return cache[cache_key]["num_threads"]
+
+    timings = {}
+    for num_threads in sorted(set(candidates)):
+        with controller.limit(limits=num_threads):
+            for _ in range(n_warmup):
+                func()
+            durations = []
+            for _ in range(n_repeats):
+                t = time.perf_counter()
+                func()
+                durations.append(time.perf_counter() - t)
+        timings[num_threads] = sorted(durations)[len(durations) // 2]
+    best = min(timings, key=timings.get)
+
+    # Reload the cache to not lose the entries added concurrently while tuning
+    cache = _load_tune_cache(cache_file)
+    cache[cache_key] = {
+        "num_threads": best,
+        "timings": {str(num_threads): t for num_threads, t in timings.items()},
+    }
+    _save_tune_cache(cache_file, cache)
+    return best
+
+
+# Limits set in the child processes created by os.fork, see set_child_limits.
+_child_limits = None
+
+
+def set_child_limits(limits=None, user_api=None):
+    """Set limits to apply in each child process created by forking this process.
+
+    Prefork servers, e.g. gunicorn, fork their workers from a master process. The
+    library controllers discovered in the master are reused in the workers without
+    rescanning the loaded libraries, and the limits set from other threads than the
+    one that forked are dropped since these threads do not exist in the workers.
+    This function additionally sets limits in each worker right after the fork, for
+    its whole lifetime.
+
+    Parameters
+    ----------
+    limits : int, dict, str or None (default=None)
+        The limits to set in the child processes, see `threadpool_limits`, e.g. "auto"
+        or 1 to let each worker run single-threaded. If None, no limits are set in
+        the child processes.
+
+    user_api : "blas", "openmp" or None (default=None)
+        APIs of libraries to limit, see `threadpool_limits`.
+    """
+    global _child_limits
+
+    if limits is None:
+        _child_limits = None
+    else:
+        # Validate the parameters in the parent process
+        _ThreadpoolLimiter.wrap(
+            ThreadpoolController._from_controllers([]),
+            limits=limits,
+            user_api=user_api,
+        )
+        _child_limits = {"limits": limits, "user_api": user_api}
+
+
+def _before_fork():
+    # Wait for the other threads to be done with the shared state such that it's
+    # consistent in the child process.
+    ThreadpoolController._shared_instance_lock.acquire()
+    _limit_stack.lock.acquire()
+
+
+def _after_fork_in_parent():
+    _limit_stack.lock.release()
+    ThreadpoolController._shared_instance_lock.release()
+
+
+def _after_fork_in_child():
+    # The locks were acquired by the thread that forked, which is the only thread of
+    # the child process, but they are recreated to not depend on the internals of
+    # their implementations.
+    ThreadpoolController._shared_instance_lock = threading.Lock()
+    _send_events(_limit_stack._reset_after_fork())
+    if _child_limits is not None:
+        threadpool_limits(**_child_limits)
+
+
+# When run with `python -m threadpoolctl`, this module is executed as __main__ and the
+# command line is delegated to the threadpoolctl module, imported separately, which is
+# the one shared with the code run by the "run" command. The process-wide hooks are
+# only installed by the latter, such that they are installed once.
+if __name__ != "__main__":
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(
+            before=_before_fork,
+            after_in_parent=_after_fork_in_parent,
+            after_in_child=_after_fork_in_child,
+        )
+
+    # Write the last record of the trace, if any, when the interpreter exits
+    atexit.register(stop_trace)
+
+    if os.environ.get("THREADPOOLCTL_TRACE"):
+        start_trace(os.environ["THREADPOOLCTL_TRACE"])
+
+
+def _read_trace(path):
+    """Records of a file written by start_trace, sorted by timestamp"""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record["ts"])
+
+
+def _get_trace_library_key(record):
+    """Identify the number of threads setting of a library in a trace
+
+    As in `_LimitStack`, libraries with a per-thread setting are tracked
+    separately for each thread.
+    """
+    per_thread = any(
+        controller_class._per_thread_num_threads
+        for controller_class in _ALL_CONTROLLERS
+        if controller_class.internal_api == record["internal_api"]
+    )
+    return record["pid"], record["filepath"], record["tid"] if per_thread else None
+
+
+def _summarize_trace(records):
+    """Time spent at each number of threads per library
+
+    For each library, the number of threads before its first change is assumed from
+    the start of the trace of its process, and the last one until its end. The time
+    spent at a number of threads is also split by the caller that set it.
+    """
+    # Time span of the trace of each process
+    spans = {}
+    for record in records:
+        start, _ = spans.get(record["pid"], (record["ts"], None))
+        spans[record["pid"]] = start, record["ts"]
+
+    changes = {}
+    for record in records:
+        if record["event"] == "set_num_threads":
+            changes.setdefault(_get_trace_library_key(record), []).append(record)
+
+    summary = {}
+    for (pid, filepath, _), library_changes in changes.items():
+        start, end = spans[pid]
+        library = summary.setdefault(
+            filepath,
+            {"internal_api": library_changes[0]["internal_api"], "num_threads": {}},
+        )
+        segments = [(start, library_changes[0]["before"], None)]
+        segments += [(r["ts"], r["after"], r["caller"]) for r in library_changes]
+        ends = [ts for ts, _, _ in segments[1:]] + [end]
+        for (ts, num_threads, caller), segment_end in zip(segments, ends):
+            seconds = (segment_end - ts) / 1e9
+            stats = library["num_threads"].setdefault(
+                str(num_threads), {"seconds": 0.0, "callers": {}}
+            )
+            stats["seconds"] += seconds
+            if caller is not None:
+                stats["callers"][caller] = stats["callers"].get(caller, 0.0) + seconds
+    return summary
+
+
+def _trace_to_chrome(records):
+    """Convert the records of a trace to the Chrome trace event format
+
+    Each limiter is a slice of the thread that entered it, each set_num_threads call
+    is a slice holding the numbers of threads before and after the call, and the
+    number of threads of each library is a counter track of its process.
+    """
+    trace_events = []
+    counters = set()
+    starts = {}
+    for record in records:
+        ts = record["ts"] / 1e3  # microseconds
+        ids = {"pid": record["pid"], "tid": record["tid"]}
+        starts.setdefault(record["pid"], ts)
+        event = record["event"]
+        if event in ("limits_enter", "limits_exit"):
+            phase = "B" if event == "limits_enter" else "E"
+            args = {"limits": record["limits"]}
+            trace_events.append(
+                {"name": "limits", "ph": phase, "ts": ts, **ids, "args": args}
+            )
+        elif event == "set_num_threads":
+            key = _get_trace_library_key(record)
+            name = f"num_threads {record['internal_api']} {record['filepath']}"
+            if key[2] is not None:
+                name += f" (thread {key[2]})"
+            if key not in counters:
+                counters.add(key)
+                trace_events.append(
+                    {
+                        "name": name,
+                        "ph": "C",
+                        "ts": starts[record["pid"]],
+                        "pid": record["pid"],
+                        "args": {"num_threads": record["before"]},
+                    }
+                )
+            trace_events.append(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": ts,
+                    "pid": record["pid"],
+                    "args": {"num_threads": record["after"]},
+                }
+            )
+            trace_events.append(
+                {
+                    "name": "set_num_threads",
+                    "ph": "X",
+                    "ts": ts - record["duration"] * 1e6,
+                    "dur": record["duration"] * 1e6,
+                    **ids,
+                    "args": {key: record[key] for key in ("before", "after", "caller")},
+                }
+            )
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+def _trace_main(argv):
+    """Commandline interface to analyze a file written by start_trace."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m threadpoolctl trace",
+        usage="python -m threadpoolctl trace trace.jsonl --chrome trace.json",
+        description=(
+            "Display the time spent at each number of threads per library, from a "
+            "file recorded with threadpoolctl.start_trace or THREADPOOLCTL_TRACE."
+        ),
+    )
+    parser.add_argument("path", help="The file of the recorded trace.")
+    parser.add_argument(
+        "--chrome",
+        help=(
+            "Also convert the trace to the Chrome trace event format in this file, "
+            "which can be opened with Perfetto or chrome://tracing."
+        ),
+    )
+
+    options = parser.parse_args(argv)
+    records = _read_trace(options.path)
+    if options.chrome:
+        with open(options.chrome, "w") as f:
+            json.dump(_trace_to_chrome(records), f)
+
+    print(json.dumps(_summarize_trace(records), indent=2))
+
+
+class _LimitsImportHook:
+    """Meta path finder setting limits on the libraries loaded by each import
+
+    It lets the other finders find the module, and wraps the `exec_module` method of
+    the loader of the module to set the limits on the libraries that were loaded while
+    executing it. The limits are set for the rest of the lifetime of the process.
+    """
+
+    def __init__(self, limits, user_api):
+        self._limits = limits
+        self._user_api = user_api
+        self._limited_filepaths = set()
+
+    def limit_new_libraries(self):
+        """Set the limits on the libraries loaded since the last call"""
+        controller = ThreadpoolController._get_shared_instance()
+        new_lib_controllers = [
+            lib_controller
+            for lib_controller in controller.lib_controllers
+            if lib_controller.filepath not in self._limited_filepaths
+        ]
+        if not new_lib_controllers:
+            return
+        self._limited_filepaths.update(lc.filepath for lc in new_lib_controllers)
+        _ThreadpoolLimiter(
+            ThreadpoolController._from_controllers(new_lib_controllers),
+            limits=self._limits,
+            user_api=self._user_api,
+        )
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        loader = spec.loader
+        if (
+            loader is None
+            # Builtin and frozen modules are loaded by classes, which don't load
+            # shared libraries.
+            or isinstance(loader, type)
+            or not hasattr(loader, "exec_module")
+            or getattr(loader.exec_module, "_limits_import_hook", False)
+        ):
+            return spec
+
+        exec_module = loader.exec_module
+
+        def exec_module_with_limits(module):
+            try:
+                exec_module(module)
+            finally:
+                self.limit_new_libraries()
+
+        exec_module_with_limits._limits_import_hook = True
+        try:
+            loader.exec_module = exec_module_with_limits
+        except AttributeError:  # pragma: no cover
+            pass
+        return spec
+
+
+def _parse_limits_option(value):
+    """Parse the --limits option of the run command, e.g. "blas=1,openmp=4" """
+    if value in ("auto", "sequential_blas_under_openmp"):
+        return value
+    try:
+        if "=" not in value:
+            return int(value)
+        limits = {}
+        for item in value.split(","):
+            key, num_threads = item.split("=")
+            limits[key.strip()] = int(num_threads)
+        return limits
+    except ValueError:
+        raise ValueError(
+            "limits must either be an int, 'auto', 'sequential_blas_under_openmp' or "
+            f"a comma separated list of key=int, e.g. 'blas=1,openmp=4'. Got {value!r} "
+            "instead."
+        ) from None
+
+
+def _get_info_diff(before, after):
+    """Difference between two results of threadpool_info"""
+    before = {lib_info["filepath"]: lib_info for lib_info in before}
+    after = {lib_info["filepath"]: lib_info for lib_info in after}
+    return {
+        "loaded": [after[fp] for fp in after if fp not in before],
+        "unloaded": [before[fp] for fp in before if fp not in after],
+        "changed": [
+            {
+                "filepath": fp,
+                "prefix": after[fp]["prefix"],
+                "num_threads": {
+                    "before": before[fp]["num_threads"],
+                    "after": after[fp]["num_threads"],
+                },
+            }
+            for fp in after
+            if fp in before and before[fp]["num_threads"] != after[fp]["num_threads"]
+        ],
+    }
+
+
+def _run_main(argv):
+    """Commandline interface to run a script or a module with limits."""
+    import argparse
+    import runpy
+
+    parser = argparse.ArgumentParser(
+        prog="python -m threadpoolctl run",
+        usage=(
+            "python -m threadpoolctl run [--limits LIMITS] [--user-api USER_API] "
+            "[--info-diff] (-m module | [--] script) [args ...]"
+        ),
+        description=(
+            "Run a script or a module, as python would, with limits set on the "
+            "libraries already loaded and on the libraries loaded during the run."
+        ),
+    )
+    parser.add_argument(
+        "--limits",
+        help=(
+            "The limits, as accepted by threadpool_limits: an int, 'auto', "
+            "'sequential_blas_under_openmp', or a comma separated list of "
+            "user_api=int or prefix=int, e.g. 'blas=1,openmp=4'. Defaults to 'auto', "
+            "i.e. the number of CPUs the process can use."
+        ),
+    )
+    parser.add_argument(
+        "--user-api",
+        help="The user API to limit when --limits is an int, e.g. 'blas'.",
+    )
+    parser.add_argument(
+        "--info-diff",
+        action="store_true",
+        help=(
+            "Display on STDERR the differences of thread-pool information between "
+            "the start of the run and its end."
+        ),
+    )
+
+    # The options of the run command stop at the target, which is followed by its
+    # own arguments.
+    i = 0
+    while i < len(argv) and argv[i].startswith("-") and argv[i] not in ("-m", "--"):
+        i += 2 if argv[i] in ("--limits", "--user-api") else 1
+    options = parser.parse_args(argv[:i])
+    target = argv[i:]
+    if target[:1] == ["--"]:
+        target = target[1:]
+    if not target or target == ["-m"]:
+        parser.error("a script or a module (-m) to run is required")
+
+    try:
+        limits = _parse_limits_option(options.limits or "auto")
+    except ValueError as e:
+        parser.error(str(e))
+    user_api = options.user_api
+    if limits == "auto":
+        limits = available_cpus()
+
+    # For the libraries loaded by other means than an import, e.g. lazily with
+    # ctypes, and for the subprocesses.
+    if isinstance(limits, int):
+        _set_num_threads_env_vars(
+            {api: limits for api in _NUM_THREADS_ENV_VARS if user_api in (None, api)}
+        )
+    elif isinstance(limits, dict):
+        _set_num_threads_env_vars(limits)
+
+    try:
+        # Validate the parameters even if no library is loaded yet
+        _ThreadpoolLimiter.wrap(
+            ThreadpoolController._from_controllers([]),
+            limits=limits,
+            user_api=user_api,
+        )
+    except (TypeError, ValueError) as e:
+        parser.error(str(e))
+
+    hook = _LimitsImportHook(limits, user_api)
+    hook.limit_new_libraries()
+    sys.meta_path.insert(0, hook)
+
+    info_before = threadpool_info()
+    try:
+        if target[0] == "-m":
+            sys.argv = target[1:]
+            runpy.run_module(target[1], run_name="__main__", alter_sys=True)
+        else:
+            sys.argv = target
+            sys.path[0] = os.path.dirname(os.path.abspath(target[0]))
+            runpy.run_path(target[0], run_name="__main__")
+    finally:
+        if options.info_diff:
+            info_diff = _get_info_diff(info_before, threadpool_info())
+            print(json.dumps(info_diff, indent=2), file=sys.stderr)
+
+
 def _main():
     """Commandline interface to display thread-pool information and exit."""
     import argparse
@@ -1262,9 +3771,22 @@ def _main():
     import json
     import sys
 
+    if sys.argv[1:2] == ["trace"]:
+        _trace_main(sys.argv[2:])
+        return
+
+    if sys.argv[1:2] == ["run"]:
+        _run_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         usage="python -m threadpoolctl -i numpy scipy.linalg xgboost",
         description="Display thread-pool information and exit.",
+        epilog=(
+            "Use 'python -m threadpoolctl run -h' to run a script or a module with "
+            "limits, and 'python -m threadpoolctl trace -h' to analyze a trace "
+            "recorded with threadpoolctl.start_trace."
+        ),
     )
     parser.add_argument(
         "-i",
@@ -1279,6 +3801,14 @@ def _main():
         "--command",
         help="a Python statement to execute before introspecting thread-pools.",
     )
+    parser.add_argument(
+        "--oversubscription-report",
+        action="store_true",
+        help=(
+            "Display an estimate of the worst-case number of threads running "
+            "concurrently instead of the thread-pool information."
+        ),
+    )
 
     options = parser.parse_args(sys.argv[1:])
     for module in options.modules:
@@ -1290,8 +3820,13 @@ def _main():
     if options.command:
         exec(options.command)
 
-    print(json.dumps(threadpool_info(), indent=2))
+    if options.oversubscription_report:
+        print(json.dumps(ThreadpoolController().oversubscription_report(), indent=2))
+    else:
+        print(json.dumps(threadpool_info(), indent=2))
 
 
 if __name__ == "__main__":
-    _main()
+    import threadpoolctl
+
+    threadpoolctl._main()